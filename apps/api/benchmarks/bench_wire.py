@@ -0,0 +1,70 @@
+"""Bytes on the wire and server CPU per 1000 chunks for each session codec.
+
+Run from ``apps/api``::
+
+    python benchmarks/bench_wire.py [chunks]
+
+Each codec encodes the same stream of ``partial`` frames (token-sized text
+chunks) followed by a ``final`` frame, the same way ``/ws/session/{id}`` does,
+including constructing the canonical ``schemas.Out`` model for every frame.
+"""
+
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from schemas import Out  # noqa: E402
+from services import wire  # noqa: E402
+
+SESSION_ID = "3f9c2a4e-8d1b-4c7a-9f0e-2b6d5a1c7e90"
+MESSAGE_ID = "b7e1d0c2-5a4f-4e3b-8c9d-1f2a3b4c5d6e"
+TOKENS = ["The ", "quick ", "brown ", "fox ", "jumps ", "over ", "the ", "lazy ", "dog", ".\n"]
+
+
+CODECS = {"json": wire.JsonCodec, "compact": wire.CompactCodec, "msgpack": wire.MsgpackCodec}
+
+
+def measure(codec_cls, chunks: int = 1000, repeat: int = 5) -> Dict[str, float]:
+    """Return payload bytes and on-wire bytes for one stream, plus best CPU time."""
+    payload_bytes = wire_bytes = 0
+    best_cpu = float("inf")
+    for _ in range(repeat):
+        codec = codec_cls()
+        payload_bytes = wire_bytes = 0
+        started = time.process_time()
+        for i in range(chunks):
+            text = TOKENS[i % len(TOKENS)]
+            frame = codec.encode(Out(type="partial", sessionId=SESSION_ID, messageId=MESSAGE_ID, payload={"text": text}))
+            payload_bytes += len(text.encode())
+            wire_bytes += len(frame if isinstance(frame, bytes) else frame.encode())
+        frame = codec.encode(Out(type="final", sessionId=SESSION_ID, messageId=MESSAGE_ID, payload={"done": True}))
+        wire_bytes += len(frame if isinstance(frame, bytes) else frame.encode())
+        best_cpu = min(best_cpu, time.process_time() - started)
+    scale = 1000 / chunks
+    return {
+        "payloadBytes": payload_bytes * scale,
+        "wireBytes": wire_bytes * scale,
+        "cpuMs": best_cpu * 1000 * scale,
+    }
+
+
+def run(chunks: int = 1000) -> Dict[str, Dict[str, float]]:
+    return {name: measure(cls, chunks) for name, cls in CODECS.items()}
+
+
+def main(argv: List[str]) -> None:
+    chunks = int(argv[1]) if len(argv) > 1 else 1000
+    results = run(chunks)
+    base = results["json"]["wireBytes"]
+    print(f"per 1000 chunks ({chunks} measured)")
+    print(f"{'codec':<10}{'wire bytes':>12}{'vs json':>9}{'overhead':>10}{'cpu ms':>9}")
+    for name, r in results.items():
+        overhead = r["wireBytes"] / r["payloadBytes"]
+        print(f"{name:<10}{r['wireBytes']:>12.0f}{r['wireBytes'] / base:>8.0%}{overhead:>9.1f}x{r['cpuMs']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
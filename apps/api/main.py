@@ -1,39 +1,25 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.middleware.cors import CORSMiddleware
-from schemas import Out
-from settings import settings
-from services.codex_adapter import invoke_codex
-from routers.fs import router as fs_router
-import json, uuid, asyncio, os, sys, contextlib
+"""FastAPI entrypoint.
+
+Importing this module is deliberately cheap: routers, settings and heavy
+subsystems are loaded by :func:`create_app` or on first use. Run with
+``uvicorn --factory main:create_app``; ``main:app`` also works and builds the
+app on first access.
+"""
+
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Optional
+import asyncio, contextlib, uuid, os, sys
+
+from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+
+from services.coord import Coordinator
+from services.subsystems import Subsystems, import_loader
+
 
-# Optional PTY deps for POSIX
-try:  # pragma: no cover - platform specific
-    import pty  # type: ignore
-    import fcntl  # type: ignore
-    import struct  # type: ignore
-    POSIX = os.name != "nt"
-except Exception:  # pragma: no cover
-    pty = None  # type: ignore
-    fcntl = None  # type: ignore
-    struct = None  # type: ignore
-    POSIX = False
-
-app = FastAPI()
-# Support comma-separated origins
-origins = [o.strip() for o in (settings.cors_origin or "").split(",") if o.strip()]
-app.add_middleware(CORSMiddleware, allow_origins=origins or [settings.cors_origin], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
-
-@app.get("/health")
-def health():
-    root_ok = Path(settings.project_root).exists()
-    codex_ok = bool(os.getenv("CODEX_COMMAND", "").strip())
-    return {"ok": True, "projectRoot": root_ok, "codexConfigured": codex_ok}
-
-
-@app.on_event("startup")
-async def on_startup():
-    root = Path(settings.project_root)
+def _check_project_root(project_root: str) -> None:
+    root = Path(project_root)
     if not root.exists() or not root.is_dir():
         # Fail fast with a descriptive message
         msg = f"Invalid PROJECT_ROOT: {root}. Set PROJECT_ROOT to your workspace path."
@@ -41,168 +27,235 @@ async def on_startup():
         print(msg, file=sys.stderr)
         raise RuntimeError(msg)
 
-# REST routers
-app.include_router(fs_router, prefix="/api")
-
-@app.websocket("/ws/session/{session_id}")
-async def session_ws(ws: WebSocket, session_id: str):
-    await ws.accept()
-    try:
-        while True:
-            raw = await ws.receive_text()
-            ev = json.loads(raw)
-            message_id = ev.get("messageId") or str(uuid.uuid4())
-            prompt = ev.get("payload",{}).get("text","")
-            async for chunk in invoke_codex(prompt):
-                await ws.send_text(Out(type="partial", sessionId=session_id, messageId=message_id, payload={"text": chunk}).model_dump_json())
-            await ws.send_text(Out(type="final", sessionId=session_id, messageId=message_id, payload={"done": True}).model_dump_json())
-    except WebSocketDisconnect:
-        pass
-
-
-@app.websocket("/ws/terminal")
-async def terminal_ws(ws: WebSocket):
-    """Spawn a shell and proxy data over WebSocket.
-
-    Client messages:
-      {"type":"input","data":"..."}
-      {"type":"resize","cols":80,"rows":24}
-
-    Server messages:
-      {"type":"output","data":"..."}
+
+def create_app(warmup: bool = True, coordinator: Optional[Coordinator] = None) -> FastAPI:
+    """Build the API application.
+
+    ``warmup`` controls whether heavy subsystems are initialised in the
+    background after startup; when disabled they load on first use.
+    ``coordinator`` overrides the one built from settings, e.g. to share an
+    in-memory store between several apps in one process.
     """
-    await ws.accept()
+    from fastapi.middleware.cors import CORSMiddleware
+    from settings import settings
+    from routers.fs import router as fs_router
+    from services import coord, fs_events
+    from services.registry import Refused, Registry
+
+    subsystems = Subsystems()
+    subsystems.register("codex", import_loader("services.codex_adapter"))
+    subsystems.register("terminal", import_loader("services.terminal"))
+    # Watches PROJECT_ROOT only while a client is subscribed to /ws/fs
+    fs_hub = fs_events.FsEventHub(settings.project_root)
+    # Ownership of sessions/terminals and state shared between workers. Its
+    # store (Redis with COORDINATION=redis) connects when this subsystem
+    # loads; the heartbeat then keeps its readiness current.
+    coordinator = coordinator or coord.from_settings(settings)
+
+    def load_coordination():
+        coordinator.store.ping()
+        return coordinator
+
+    subsystems.register("coordination", load_coordination)
 
-    if POSIX and pty is not None:
-        # PTY-backed shell on POSIX
-        shell = os.environ.get("SHELL") or ("/bin/bash" if os.path.exists("/bin/bash") else "/bin/sh")
+    def store_failed(exc: BaseException) -> None:
+        subsystems.report("coordination", exc)
 
-        # Fork a child connected to a pty
-        pid, master_fd = pty.fork()  # type: ignore[attr-defined]
-        if pid == 0:  # Child
-            # Optional: chdir to project root
+    def claimer(kind: str):
+        async def claim(rid: str) -> None:
+            # Claim again: a teardown may have released it since route()
             try:
-                os.chdir(settings.project_root)
-            except Exception:
-                pass
-            os.execvp(shell, [shell])
-            os._exit(1)
+                owner = await asyncio.to_thread(coordinator.claim, kind, rid)
+            except Exception as exc:
+                store_failed(exc)
+                raise Refused("coordination store unavailable") from exc
+            if owner != coordinator.me:
+                raise Refused(f"{kind} {rid} is owned by worker {owner.worker_id}")
 
-        # Parent: interact with master_fd
-        loop = asyncio.get_running_loop()
-        stop = asyncio.Event()
+        return claim
 
-        async def pump_master():
+    def releaser(kind: str):
+        async def release(rid: str) -> None:
             try:
-                while not stop.is_set():
-                    # Use to_thread to avoid blocking loop
-                    data = await asyncio.to_thread(os.read, master_fd, 1024)
-                    if not data:
-                        break
-                    try:
-                        await ws.send_text(json.dumps({"type": "output", "data": data.decode(errors="ignore")}))
-                    except RuntimeError:
-                        break
-            except Exception:
-                pass
+                await asyncio.to_thread(coordinator.release, kind, rid)
+            except Exception as exc:
+                # The claim is no longer refreshed and expires on its own
+                store_failed(exc)
+
+        return release
 
-        reader_task = asyncio.create_task(pump_master())
+    # Live sessions/terminals; ownership is held exactly while an entry lives
+    sessions = Registry(on_open=claimer("session"), on_close=releaser("session"))
+    terminals = Registry(on_open=claimer("terminal"), on_close=releaser("terminal"))
 
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        _check_project_root(settings.project_root)
+        if warmup:
+            subsystems.start_warmup()
+        stop_heartbeat = asyncio.Event()
+        heartbeat = asyncio.create_task(
+            coordinator.run_heartbeat(stop_heartbeat, lambda error: subsystems.report("coordination", error))
+        )
         try:
-            while True:
-                msg = await ws.receive_text()
-                try:
-                    ev = json.loads(msg)
-                except json.JSONDecodeError:
-                    ev = {"type": "input", "data": msg}
-
-                if ev.get("type") == "input":
-                    data = ev.get("data", "")
-                    if data:
-                        try:
-                            await asyncio.to_thread(os.write, master_fd, data.encode())
-                        except Exception:
-                            break
-                elif ev.get("type") == "resize" and fcntl is not None and struct is not None:
-                    try:
-                        cols = int(ev.get("cols", 80))
-                        rows = int(ev.get("rows", 24))
-                        winsz = struct.pack("HHHH", rows, cols, 0, 0)
-                        await asyncio.to_thread(fcntl.ioctl, master_fd, 0x5414, winsz)  # TIOCSWINSZ
-                    except Exception:
-                        # Ignore resize errors
-                        pass
-        except WebSocketDisconnect:
-            pass
+            yield
         finally:
-            stop.set()
-            reader_task.cancel()
-            with contextlib.suppress(Exception):
-                await reader_task
-            with contextlib.suppress(Exception):
-                os.close(master_fd)
-            with contextlib.suppress(Exception):
-                # Gracefully terminate child
-                os.kill(pid, 15)
-    else:
-        # Windows or fallback: subprocess with pipes
-        if os.name == "nt":
-            cmd = ["powershell.exe", "-NoLogo"]
-        else:
-            cmd = ["/bin/bash"] if os.path.exists("/bin/bash") else ["/bin/sh"]
-
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-        )
+            # Wait for an in-flight heartbeat so it cannot re-register us
+            stop_heartbeat.set()
+            with contextlib.suppress(asyncio.CancelledError):
+                await heartbeat
+            await sessions.close_all()
+            await terminals.close_all()
+            await coordinator.stop()
+            await fs_hub.stop()
+            await subsystems.stop()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.subsystems = subsystems
+    app.state.fs_events = fs_hub
+    app.state.coord = coordinator
+    app.state.sessions = sessions
+    app.state.terminals = terminals
+    # Support comma-separated origins
+    origins = [o.strip() for o in (settings.cors_origin or "").split(",") if o.strip()]
+    app.add_middleware(CORSMiddleware, allow_origins=origins or [settings.cors_origin], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+
+    @app.get("/health")
+    def health():
+        """Liveness: the process is up and serving requests."""
+        root_ok = Path(settings.project_root).exists()
+        codex_ok = bool(os.getenv("CODEX_COMMAND", "").strip())
+        return {"ok": True, "ready": subsystems.ready, "projectRoot": root_ok, "codexConfigured": codex_ok}
+
+    @app.get("/health/ready")
+    def ready():
+        """Readiness: every registered subsystem has finished initialising."""
+        body = {"ready": subsystems.ready, "subsystems": subsystems.status()}
+        return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+    # REST routers
+    app.include_router(fs_router, prefix="/api")
 
-        assert proc.stdin is not None and proc.stdout is not None
+    async def route(ws: WebSocket, kind: str, rid: str, registry: Registry) -> bool:
+        """Claim ``kind/rid`` for this worker, or proxy the socket to its owner.
 
-        async def pump_stdout():
+        Returns ``True`` when the caller should serve the connection from
+        ``registry``, which releases the claim when the entry is torn down.
+        """
+        if rid in registry:
+            # Live here already: reattach
+            return True
+        try:
+            forwarded = await asyncio.to_thread(coordinator.is_forwarded, ws.headers.get(coord.FORWARDED_HEADER))
+            owner = await asyncio.to_thread(coordinator.claim, kind, rid, forwarded)
+        except Exception as exc:
+            # Without the store there is no telling who owns it; ask the
+            # client to retry rather than risk two live copies
+            store_failed(exc)
+            await ws.close(code=1013, reason="Coordination store unavailable")
+            return False
+        if owner == coordinator.me:
+            return True
+        if not await coordinator.forward(ws, owner.url):
+            await ws.close(code=1013, reason="Owning worker unavailable")
+        return False
+
+    async def open_entry(ws: WebSocket, registry: Registry, rid: str, factory):
+        """Open ``rid`` in ``registry``, or close the socket and return ``None``."""
+        try:
+            return await registry.open(rid, factory)
+        except Refused:
+            await ws.close(code=1013, reason="Owning worker unavailable")
+            return None
+
+    async def within_limit(bucket: str, limit: int) -> bool:
+        try:
+            return await asyncio.to_thread(coordinator.hit, bucket, limit)
+        except Exception as exc:
+            # Fail open: an unreachable store should not lock users out
+            store_failed(exc)
+            return True
+
+    @app.websocket("/ws/session/{session_id}")
+    async def session_ws(ws: WebSocket, session_id: str):
+        """Stream Codex replies (see ``services.session``).
+
+        The session keeps running for a grace period after its last socket
+        goes away, so a reconnecting client picks up the reply in flight.
+        """
+        from schemas import Out
+        from services import wire
+        from services.session import Session
+
+        if not await route(ws, "session", session_id, sessions):
+            return
+
+        async def new_session():
+            return Session(session_id, await subsystems.get("codex"))
+
+        session = await open_entry(ws, sessions, session_id, new_session)
+        if session is None:
+            return
+        async with sessions.attached(session_id):
+            # Encoding is negotiated per connection via Sec-WebSocket-Protocol
+            codec = wire.negotiate(ws.scope.get("subprotocols", []))
+            await ws.accept(subprotocol=codec.subprotocol)
+            limit = settings.session_rate_limit
             try:
-                while True:
-                    data = await proc.stdout.read(1024)
-                    if not data:
-                        break
-                    try:
-                        await ws.send_text(json.dumps({"type": "output", "data": data.decode(errors="ignore")}))
-                    except RuntimeError:
-                        break
-            except Exception:
+                async with session.attached(ws, codec):
+                    while True:
+                        ev = await wire.receive(ws, codec)
+                        message_id = ev.get("messageId") or str(uuid.uuid4())
+                        if limit and not await within_limit(f"session:{session_id}", limit):
+                            await session.send(ws, codec, Out(type="error", sessionId=session_id, messageId=message_id, payload={"error": "rate_limited"}))
+                            continue
+                        if not session.submit(message_id, str(ev["payload"].get("text",""))):
+                            await session.send(ws, codec, Out(type="error", sessionId=session_id, messageId=message_id, payload={"error": "busy"}))
+            except WebSocketDisconnect:
                 pass
 
-        reader_task = asyncio.create_task(pump_stdout())
+    @app.websocket("/ws/terminal")
+    async def terminal_ws(ws: WebSocket, terminal_id: str = Query("", alias="id")):
+        """Spawn a shell and proxy data over WebSocket (see ``services.terminal``).
 
-        try:
-            while True:
-                msg = await ws.receive_text()
-                try:
-                    ev = json.loads(msg)
-                except json.JSONDecodeError:
-                    ev = {"type": "input", "data": msg}
-
-                if ev.get("type") == "input":
-                    data = ev.get("data", "")
-                    if data and not proc.stdin.is_closing():
-                        proc.stdin.write(data.encode())
-                        with contextlib.suppress(Exception):
-                            await proc.stdin.drain()
-                elif ev.get("type") == "resize":
-                    # No PTY configured on this path
-                    pass
-        except WebSocketDisconnect:
-            pass
-        finally:
-            with contextlib.suppress(Exception):
-                if proc.stdin and not proc.stdin.is_closing():
-                    proc.stdin.write(b"exit\n")
-                    await proc.stdin.drain()
-            with contextlib.suppress(Exception):
-                proc.terminate()  # type: ignore[attr-defined]
-            with contextlib.suppress(Exception):
-                await proc.wait()
-            reader_task.cancel()
-            with contextlib.suppress(Exception):
-                await reader_task
+        Pass ``?id=`` to route every connection for that terminal to the
+        worker that owns it; the shell then survives disconnects for a grace
+        period and a reconnect reattaches to it. Without an id the shell ends
+        with the socket.
+        """
+        if not terminal_id:
+            await ws.accept()
+            terminal = await subsystems.get("terminal")
+            await terminal.run_terminal(ws, settings.project_root)
+            return
+        if not await route(ws, "terminal", terminal_id, terminals):
+            return
+
+        async def new_terminal():
+            terminal = await subsystems.get("terminal")
+            return await terminal.open_terminal(settings.project_root)
+
+        shell = await open_entry(ws, terminals, terminal_id, new_terminal)
+        if shell is None:
+            return
+        async with terminals.attached(terminal_id):
+            await ws.accept()
+            await shell.attach(ws)
+
+    @app.websocket("/ws/fs")
+    async def fs_events_ws(ws: WebSocket):
+        """Push filesystem change events (see ``services.fs_events``)."""
+        await ws.accept()
+        await fs_events.serve(ws, fs_hub)
+
+    return app
+
+
+def __getattr__(name: str):
+    # ``uvicorn main:app`` resolves ``app`` with getattr, so build it lazily
+    # and cache it on the module for subsequent lookups.
+    if name == "app":
+        app = create_app()
+        globals()["app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from pydantic import BaseModel, ConfigDict, field_validator
 from typing import List, Optional
 from pathlib import Path
 
 from settings import settings
+from services import coord, fs_events
 from services.fs import safe_join
 
 router = APIRouter()
@@ -83,6 +84,26 @@ def _rel_from_abs(abs_path: Path) -> str:
     return str(abs_path.resolve().relative_to(root))
 
 
+def _coordinator(request: Request) -> Optional[coord.Coordinator]:
+    """The coordinator of the app serving this request (``None`` if it has none)."""
+    return getattr(request.app.state, "coord", None)
+
+
+class _Changes:
+    """Announces mutations to the serving app's event subscribers and cache."""
+
+    def __init__(self, request: Request):
+        self.events: Optional[fs_events.FsEventHub] = getattr(request.app.state, "fs_events", None)
+        self.coord = _coordinator(request)
+
+    def __call__(self, kind: str, p: Path, src: Optional[Path] = None) -> None:
+        if self.events is not None:
+            self.events.publish(kind, _rel_from_abs(p), src=_rel_from_abs(src) if src else None)
+        if self.coord is not None:
+            # Drop cached listings
+            self.coord.bump("fs")
+
+
 @router.get("/fs/list", response_model=List[FsItem])
 def list_dir(
     path: str = Query(default="", description="Relative path from PROJECT_ROOT")
@@ -103,10 +124,17 @@ def list_dir(
 
 
 @router.get("/fs/tree", response_model=List[str])
-def tree(path: str = ""):
+def tree(path: str = "", c: Optional[coord.Coordinator] = Depends(_coordinator)):
     start = _abs_from_rel(path)
     if not Path(start).exists():
         raise HTTPException(status_code=404, detail="Path not found")
+    if c is None:
+        return _walk_tree(start)
+    # Shared between workers; API mutations bump the generation
+    return c.cached(f"fs:tree:{_rel_from_abs(start)}", lambda: _walk_tree(start), generation="fs")
+
+
+def _walk_tree(start: Path) -> List[str]:
     results: List[str] = []
     cap = 5000
     for p in Path(start).rglob("*"):
@@ -143,7 +171,7 @@ def read_file(path: str = Query(..., description="Relative file path")):
 
 
 @router.post("/fs/write")
-def write_file(body: WriteBody):
+def write_file(body: WriteBody, changed: _Changes = Depends()):
     p = _abs_from_rel(body.path)
     if p.exists() and p.is_dir():
         raise HTTPException(status_code=400, detail="Cannot write a directory")
@@ -156,24 +184,29 @@ def write_file(body: WriteBody):
         raise HTTPException(
             status_code=413, detail=f"Content too large (> {MAX_TEXT_BYTES} bytes)"
         )
+    existed = p.exists()
     p.parent.mkdir(parents=True, exist_ok=True)
     p.write_text(body.content, encoding="utf-8")
+    changed(fs_events.MODIFIED if existed else fs_events.CREATED, p)
     return {"ok": True}
 
 
 @router.post("/fs/mkdir")
-def mkdir(body: MkdirBody):
+def mkdir(body: MkdirBody, changed: _Changes = Depends()):
     p = _abs_from_rel(body.path)
     if Path(settings.project_root).resolve() == Path(p).resolve():
         raise HTTPException(
             status_code=400, detail="Refusing to create the project root"
         )
+    existed = Path(p).exists()
     Path(p).mkdir(parents=body.parents, exist_ok=True)
+    if not existed:
+        changed(fs_events.CREATED, Path(p))
     return {"ok": True}
 
 
 @router.post("/fs/create")
-def create_file(body: CreateBody):
+def create_file(body: CreateBody, changed: _Changes = Depends()):
     p = _abs_from_rel(body.path)
     pp = Path(p)
     if pp.exists() and pp.is_dir():
@@ -184,12 +217,14 @@ def create_file(body: CreateBody):
         raise HTTPException(
             status_code=413, detail=f"Content too large (> {MAX_TEXT_BYTES} bytes)"
         )
+    existed = pp.exists()
     pp.write_bytes(content)
+    changed(fs_events.MODIFIED if existed else fs_events.CREATED, pp)
     return {"ok": True}
 
 
 @router.post("/fs/delete")
-def delete_path(body: PathBody):
+def delete_path(body: PathBody, changed: _Changes = Depends()):
     p = Path(_abs_from_rel(body.path))
     root = Path(settings.project_root).resolve()
     if p.resolve() == root:
@@ -204,15 +239,17 @@ def delete_path(body: PathBody):
             raise HTTPException(status_code=400, detail="Directory not empty")
     else:
         p.unlink()
+    changed(fs_events.DELETED, p)
     return {"ok": True}
 
 
 @router.post("/fs/move")
-def move_path(body: MoveBody):
+def move_path(body: MoveBody, changed: _Changes = Depends()):
     src = Path(_abs_from_rel(body.src))
     dst = Path(_abs_from_rel(body.dst))
     if not src.exists():
         raise HTTPException(status_code=404, detail="Source not found")
     dst.parent.mkdir(parents=True, exist_ok=True)
     src.replace(dst)
+    changed(fs_events.MOVED, dst, src=src)
     return {"ok": True}
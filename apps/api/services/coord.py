@@ -0,0 +1,434 @@
+"""Coordination between API worker processes.
+
+Terminal PTYs and Codex subprocesses live in the memory of the worker that
+started them. When several workers serve the same deployment, a
+:class:`Coordinator` records which worker owns each terminal and session, so
+a connection that lands on another worker is proxied to the owner. It also
+holds state that must be shared between workers: rate-limit counters and a
+small response cache.
+
+State lives in a key/value store: :class:`RedisStore` (``COORDINATION=redis``,
+using ``REDIS_URL``) for real deployments, or :class:`InMemoryStore`, the
+default, for a single process and for tests. Several coordinators can share
+one in-memory store to stand in for workers inside one process.
+
+Routing needs every worker to be reachable at its own address, given by
+``WORKER_URL`` (for example one uvicorn process per port behind a proxy).
+Workers without a ``WORKER_URL`` still share rate limits and cache entries,
+but serve every connection themselves.
+"""
+
+import asyncio
+import contextlib
+import hmac
+import json
+import secrets
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, NamedTuple, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+# Carries the workers' shared secret on connections one worker proxies to
+# another, so the owner serves them locally instead of routing them again
+FORWARDED_HEADER = "x-codex-forwarded"
+
+OWNER_TTL_S = 15.0
+
+class InMemoryStore:
+    """Thread-safe, process-local stand-in for :class:`RedisStore`.
+
+    Expired keys are dropped when read and, like Redis' active expiry, swept
+    every ``SWEEP_EVERY`` writes, so keys that are never read again (old
+    cache generations, past rate-limit windows) do not pile up.
+    """
+
+    SWEEP_EVERY = 256
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def ping(self) -> bool:
+        return True
+
+    def _wrote(self) -> None:
+        # Called with the lock held
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY:
+            return
+        now = time.monotonic()
+        expired = [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]
+        for key in expired:
+            del self._data[key]
+
+    def _live(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._wrote()
+            return True
+
+    def compare_and_set(self, key: str, expected: str, value: str, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._live(key) != expected:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._wrote()
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_if(self, key: str, value: str) -> bool:
+        with self._lock:
+            if self._live(key) != value:
+                return False
+            del self._data[key]
+            return True
+
+    def incr(self, key: str, ttl: Optional[float] = None) -> int:
+        with self._lock:
+            current_value = self._live(key)
+            n = int(current_value or 0) + 1
+            expires = self._data[key][1] if current_value is not None else None
+            if expires is None and ttl:
+                expires = time.monotonic() + ttl
+            self._data[key] = (str(n), expires)
+            self._wrote()
+            return n
+
+
+class RedisStore:
+    """:class:`InMemoryStore` semantics on top of Redis."""
+
+    _DELETE_IF = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+    _COMPARE_AND_SET = (
+        "if redis.call('get', KEYS[1]) ~= ARGV[1] then return 0 end "
+        "if tonumber(ARGV[3]) > 0 then redis.call('set', KEYS[1], ARGV[2], 'PX', ARGV[3]) "
+        "else redis.call('set', KEYS[1], ARGV[2]) end return 1"
+    )
+
+    def __init__(self, url: str):
+        # The client is built on first use (normally the app's "coordination"
+        # subsystem warming up), so creating a store costs nothing.
+        self._url = url
+        self._client = None
+        self._scripts: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def _redis(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import redis
+
+                    client = redis.Redis.from_url(self._url, decode_responses=True)
+                    for name in ("_DELETE_IF", "_COMPARE_AND_SET"):
+                        self._scripts[name] = client.register_script(getattr(self, name))
+                    self._client = client
+        return self._client
+
+    def _run(self, script: str, keys, args) -> Any:
+        client = self._redis  # registers the scripts on first use
+        return self._scripts[script](keys=keys, args=args, client=client)
+
+    def ping(self) -> bool:
+        return bool(self._redis.ping())
+
+    def get(self, key: str) -> Optional[str]:
+        return self._redis.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        px = int(ttl * 1000) if ttl else None
+        return bool(self._redis.set(key, value, px=px, nx=nx))
+
+    def compare_and_set(self, key: str, expected: str, value: str, ttl: Optional[float] = None) -> bool:
+        px = int(ttl * 1000) if ttl else 0
+        return bool(self._run("_COMPARE_AND_SET", [key], [expected, value, px]))
+
+    def delete(self, key: str) -> None:
+        self._redis.delete(key)
+
+    def delete_if(self, key: str, value: str) -> bool:
+        return bool(self._run("_DELETE_IF", [key], [value]))
+
+    def incr(self, key: str, ttl: Optional[float] = None) -> int:
+        n = self._redis.incr(key)
+        if n == 1 and ttl:
+            self._redis.pexpire(key, int(ttl * 1000))
+        return n
+
+
+class Owner(NamedTuple):
+    worker_id: str
+    url: str
+
+
+class Coordinator:
+    """Ownership, rate limits and cache for one worker.
+
+    Store calls are blocking; async callers should go through
+    ``asyncio.to_thread``.
+    """
+
+    def __init__(
+        self,
+        store,
+        worker_id: Optional[str] = None,
+        worker_url: str = "",
+        ttl: float = OWNER_TTL_S,
+        cache_ttl: float = 0.0,
+    ):
+        self.store = store
+        self.worker_id = worker_id or uuid.uuid4().hex[:12]
+        self.worker_url = worker_url.rstrip("/")
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self._owned: Set[str] = set()
+        self._lock = threading.Lock()
+        self._secret: Optional[str] = None
+
+    @property
+    def me(self) -> Owner:
+        return Owner(self.worker_id, self.worker_url)
+
+    def _stamp(self) -> str:
+        return f"{self.worker_id} {self.worker_url}"
+
+    # -- ownership -------------------------------------------------------
+
+    def alive(self, worker_id: str) -> bool:
+        return worker_id == self.worker_id or self.store.get(f"worker:{worker_id}") is not None
+
+    def claim(self, kind: str, rid: str, force: bool = False) -> Owner:
+        """Take ownership of ``kind/rid`` unless a live worker already has it.
+
+        Returns the owner; compare with :attr:`me`. Claims are idempotent and
+        held until :meth:`release`. ``force`` takes over from a live owner and
+        is only for connections another worker forwarded here.
+        """
+        if not self.worker_url:
+            # Unroutable worker: serve locally without recording ownership
+            return self.me
+        key = f"own:{kind}:{rid}"
+        stamp = self._stamp()
+        for _ in range(3):
+            if self.store.set(key, stamp, self.ttl, nx=True):
+                break
+            held = self.store.get(key)
+            if held is None:
+                continue  # expired in between; try to grab it again
+            if held != stamp:
+                worker_id, _, url = held.partition(" ")
+                if not force and self.alive(worker_id):
+                    return Owner(worker_id, url)
+            # Ours already, a dead worker's, or forced. Compare-and-set so
+            # two workers taking over from the same dead owner cannot both win.
+            if self.store.compare_and_set(key, held, stamp, self.ttl):
+                break
+        else:
+            held = self.store.get(key) or stamp
+            worker_id, _, url = held.partition(" ")
+            if worker_id != self.worker_id:
+                return Owner(worker_id, url)
+        with self._lock:
+            self._owned.add(key)
+        return self.me
+
+    def release(self, kind: str, rid: str) -> None:
+        key = f"own:{kind}:{rid}"
+        with self._lock:
+            if key not in self._owned:
+                return
+            self._owned.discard(key)
+        self.store.delete_if(key, self._stamp())
+
+    def forward_token(self) -> str:
+        """The secret shared by all workers on this store, created on first use."""
+        if self._secret is None:
+            self.store.set("coord:secret", secrets.token_hex(16), nx=True)
+            self._secret = self.store.get("coord:secret") or ""
+        return self._secret
+
+    def is_forwarded(self, header: Optional[str]) -> bool:
+        """Whether ``header`` proves the connection was proxied by a worker."""
+        if not header:
+            return False
+        token = self.forward_token()
+        return bool(token) and hmac.compare_digest(header, token)
+
+    def heartbeat(self) -> None:
+        """Advertise this worker and refresh the TTL on everything it owns.
+
+        Unroutable workers own nothing and only check the store is reachable.
+        """
+        if not self.worker_url:
+            self.store.ping()
+            return
+        stamp = self._stamp()
+        self.store.set(f"worker:{self.worker_id}", self.worker_url, self.ttl)
+        with self._lock:
+            keys = list(self._owned)
+        for key in keys:
+            if self.store.get(key) in (None, stamp):
+                self.store.set(key, stamp, self.ttl)
+
+    async def run_heartbeat(
+        self, stop: asyncio.Event, report: Optional[Callable[[Optional[BaseException]], None]] = None
+    ) -> None:
+        """Heartbeat until ``stop`` is set.
+
+        Stopping through an event rather than cancellation means a heartbeat
+        already running in its thread finishes before this returns, so it
+        cannot re-register the worker after :meth:`stop`. ``report`` is called
+        with each heartbeat's error, or ``None`` when it succeeded.
+        """
+        while not stop.is_set():
+            error: Optional[BaseException] = None
+            try:
+                await asyncio.to_thread(self.heartbeat)
+            except Exception as exc:
+                error = exc
+            if report is not None:
+                report(error)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop.wait(), self.ttl / 3)
+
+    async def stop(self) -> None:
+        with self._lock:
+            keys, self._owned = list(self._owned), set()
+        stamp = self._stamp()
+        with contextlib.suppress(Exception):
+            for key in keys:
+                await asyncio.to_thread(self.store.delete_if, key, stamp)
+            if self.worker_url:
+                await asyncio.to_thread(self.store.delete, f"worker:{self.worker_id}")
+
+    # -- shared state ----------------------------------------------------
+
+    def hit(self, bucket: str, limit: int, window: float = 60.0) -> bool:
+        """Count one event against a fixed-window limit shared by all workers.
+
+        Returns ``False`` once ``limit`` events were seen in this window.
+        """
+        slot = int(time.time() // window)
+        return self.store.incr(f"rl:{bucket}:{slot}", window) <= limit
+
+    def generation(self, name: str) -> str:
+        return self.store.get(f"gen:{name}") or "0"
+
+    def bump(self, name: str) -> None:
+        """Invalidate every cache entry keyed on ``generation(name)``.
+
+        A no-op with caching off. Store errors are ignored: entries written
+        before the outage then live out their ``cache_ttl``.
+        """
+        if self.cache_ttl <= 0:
+            return
+        with contextlib.suppress(Exception):
+            self.store.incr(f"gen:{name}")
+
+    def cached(self, key: str, compute: Callable[[], Any], generation: Optional[str] = None) -> Any:
+        """Return a JSON-serialisable value from the shared cache or ``compute``.
+
+        ``generation`` names a counter folded into the key, so :meth:`bump`
+        invalidates the entry. With caching off, or when the store cannot be
+        reached, this is just ``compute()``.
+        """
+        if self.cache_ttl <= 0:
+            return compute()
+        try:
+            if generation:
+                key = f"{key}:{self.generation(generation)}"
+            raw = self.store.get(f"cache:{key}")
+        except Exception:
+            return compute()
+        if raw is not None:
+            return json.loads(raw)
+        value = compute()
+        with contextlib.suppress(Exception):
+            self.store.set(f"cache:{key}", json.dumps(value), self.cache_ttl)
+        return value
+
+    # -- routing ---------------------------------------------------------
+
+    async def forward(self, ws: WebSocket, owner_url: str) -> bool:
+        """Proxy a not-yet-accepted client socket to the same path on the owner.
+
+        Returns ``False`` without accepting if the owner cannot be reached.
+        """
+        from websockets.asyncio.client import connect
+
+        base = owner_url.rstrip("/")
+        if base.startswith("http"):
+            base = "ws" + base[len("http"):]
+        target = base + ws.url.path + (f"?{ws.url.query}" if ws.url.query else "")
+        try:
+            upstream = await connect(
+                target,
+                subprotocols=ws.scope.get("subprotocols") or None,
+                additional_headers={FORWARDED_HEADER: await asyncio.to_thread(self.forward_token)},
+            )
+        except Exception:
+            return False
+
+        await ws.accept(subprotocol=upstream.subprotocol)
+
+        async def client_to_owner():
+            while True:
+                msg = await ws.receive()
+                if msg["type"] == "websocket.disconnect":
+                    break
+                if msg.get("bytes") is not None:
+                    await upstream.send(msg["bytes"])
+                else:
+                    await upstream.send(msg.get("text") or "")
+
+        async def owner_to_client():
+            async for msg in upstream:
+                if isinstance(msg, bytes):
+                    await ws.send_bytes(msg)
+                else:
+                    await ws.send_text(msg)
+
+        tasks = [asyncio.create_task(client_to_owner()), asyncio.create_task(owner_to_client())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            with contextlib.suppress(Exception):
+                await upstream.close()
+            with contextlib.suppress(Exception):
+                await ws.close()
+        return True
+
+
+def from_settings(settings) -> Coordinator:
+    if settings.coordination == "redis":
+        store = RedisStore(settings.redis_url)
+    elif settings.coordination == "memory":
+        store = InMemoryStore()
+    else:
+        raise ValueError(f"Unknown COORDINATION: {settings.coordination!r} (expected 'memory' or 'redis')")
+    return Coordinator(store, worker_url=settings.worker_url, cache_ttl=settings.cache_ttl)
@@ -0,0 +1,458 @@
+"""Filesystem change events under ``PROJECT_ROOT``, pushed over ``/ws/fs``.
+
+Events come from two sources:
+
+* a watcher on the project root -- kernel notifications via ``watchfiles``
+  when it is installed, otherwise a periodic stat walk;
+* the fs router's own mutation handlers, through :meth:`FsEventHub.publish`
+  on the app's hub, so changes made through the API are reported without waiting for the watcher (the
+  watcher's echo of the same change is then suppressed).
+
+Events are coalesced per path over a short debounce window and published as
+numbered batches. The watcher runs while at least one client is subscribed
+and for a short grace period after the last one leaves, so an explorer that
+drops and reconnects can still replay what it missed; an idle explorer costs
+nothing.
+
+Protocol (JSON text frames)::
+
+    -> {"type": "subscribe", "id": "s1", "path": "src", "glob": ["*.py"], "since": "<token>"}
+    -> {"type": "unsubscribe", "id": "s1"}
+    <- {"type": "subscribed", "id": "s1", "token": "<token>"}
+    <- {"type": "events", "id": "s1", "token": "<token>", "events": [...]}
+    <- {"type": "resync", "id": "s1", "token": "<token>"}
+    <- {"type": "resync", "token": "<token>"}  (no id: every subscription)
+    <- {"type": "error", "id": "s1", "error": "invalid subscribe"}
+
+Each event is ``{"kind": "created"|"modified"|"deleted"|"moved", "path": ...}``
+with ``"src"`` for moves and ``"dir"`` when the path still exists. Paths are
+POSIX-style and relative to the project root. A ``since`` token replays the
+batches a reconnecting client missed; ``resync`` means that is no longer
+possible (or the client fell behind) and listings should be reloaded.
+"""
+
+import asyncio
+import contextlib
+import fnmatch
+import os
+import stat
+import time
+import uuid
+from collections import deque
+from pathlib import Path, PurePath
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+CREATED = "created"
+MODIFIED = "modified"
+DELETED = "deleted"
+MOVED = "moved"
+
+# Noise the explorer never needs to hear about (mirrors watchfiles' defaults)
+IGNORED_DIRS = frozenset(
+    {".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".next",
+     ".pytest_cache", ".mypy_cache", ".ruff_cache", ".tox", ".idea"}
+)
+
+DEBOUNCE_S = 0.05
+POLL_INTERVAL_S = 1.0
+HISTORY_BATCHES = 256
+ECHO_WINDOW_S = 2.0
+QUEUE_SIZE = 256
+IDLE_GRACE_S = 30.0
+
+Event = Dict[str, Any]
+# What a path looked like: (is_dir, mtime_ns, size), or None if it is gone
+Signature = Optional[Tuple[bool, int, int]]
+Listener = Callable[[str, List[Event]], None]
+
+def _norm(path: str) -> str:
+    rel = PurePath(path).as_posix()
+    return "" if rel == "." else rel
+
+
+def _ignored(rel: str) -> bool:
+    return any(part in IGNORED_DIRS for part in rel.split("/"))
+
+
+def _coalesce(pending: Dict[str, Event], ev: Event) -> None:
+    """Fold ``ev`` into ``pending`` (keyed by path) so one batch says it once."""
+    path = ev["path"]
+    if ev["kind"] == MOVED:
+        src = pending.pop(ev["src"], None)
+        if src is not None and src["kind"] == CREATED:
+            # Created then moved within the window: it only ever existed at dst
+            ev = {"kind": CREATED, "path": path}
+        elif src is not None and src["kind"] == MOVED:
+            ev = {"kind": MOVED, "path": path, "src": src["src"]}
+        pending[path] = ev
+        return
+
+    prev = pending.get(path)
+    if prev is None:
+        pending[path] = ev
+        return
+    pk, nk = prev["kind"], ev["kind"]
+    if pk == CREATED and nk == MODIFIED:
+        return
+    if pk == CREATED and nk == DELETED:
+        del pending[path]
+    elif pk == DELETED and nk == CREATED:
+        pending[path] = {"kind": MODIFIED, "path": path}
+    elif pk == MOVED and nk == MODIFIED:
+        return
+    elif pk == MOVED and nk == DELETED:
+        # Moved away and then deleted: net effect is the source disappearing
+        del pending[path]
+        _coalesce(pending, {"kind": DELETED, "path": prev["src"]})
+    else:
+        pending[path] = ev
+
+
+class Subscription:
+    """Path-prefix and glob filter for one client subscription.
+
+    Globs without a ``/`` match the file name, others the full relative path.
+    """
+
+    def __init__(self, sid: str, path: str = "", globs: Sequence[str] = ()):
+        self.id = sid
+        self.prefix = _norm(path).strip("/")
+        self.globs = [g for g in globs if g]
+
+    def _match(self, rel: str) -> bool:
+        if self.prefix and rel != self.prefix and not rel.startswith(self.prefix + "/"):
+            return False
+        if not self.globs:
+            return True
+        name = rel.rsplit("/", 1)[-1]
+        return any(fnmatch.fnmatchcase(rel if "/" in g else name, g) for g in self.globs)
+
+    def matches(self, ev: Event) -> bool:
+        return self._match(ev["path"]) or (ev["kind"] == MOVED and self._match(ev["src"]))
+
+    def filter(self, events: List[Event]) -> List[Event]:
+        return [ev for ev in events if self.matches(ev)]
+
+
+class FsEventHub:
+    """Collects, coalesces and fans out change events for one project root.
+
+    ``watcher`` selects the event source: ``"auto"`` (kernel, falling back to
+    polling), ``"kernel"``, ``"poll"`` or ``"none"`` (API mutations only).
+    """
+
+    def __init__(
+        self,
+        root: str,
+        watcher: str = "auto",
+        debounce: float = DEBOUNCE_S,
+        poll_interval: float = POLL_INTERVAL_S,
+        history: int = HISTORY_BATCHES,
+        idle_grace: float = IDLE_GRACE_S,
+    ):
+        self.root = Path(root).resolve()
+        self.watcher = watcher
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.idle_grace = idle_grace
+        self.backend: Optional[str] = None
+        self._listeners: List[Listener] = []
+        self._pending: Dict[str, Event] = {}
+        self._history: deque = deque(maxlen=history)
+        self._echo: Dict[str, Tuple[Signature, float]] = {}
+        self._seq = 0
+        self._epoch = ""
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._idle_stop: Optional[asyncio.Task] = None
+
+    # -- lifecycle -------------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    @property
+    def token(self) -> str:
+        return f"{self._epoch}:{self._seq}"
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        # A fresh epoch invalidates tokens handed out while we were not watching
+        self._epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._history.clear()
+        if self.watcher != "none":
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        task, self._task = self._task, None
+        self._loop = None
+        self.backend = None
+        self._pending.clear()
+        self._echo.clear()
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task
+
+    def add_listener(self, listener: Listener) -> None:
+        self._listeners.append(listener)
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        self.start()
+
+    async def remove_listener(self, listener: Listener) -> None:
+        with contextlib.suppress(ValueError):
+            self._listeners.remove(listener)
+        if self._listeners or not self.running:
+            return
+        if self.idle_grace <= 0:
+            await self.stop()
+        elif self._idle_handle is None:
+            # Keep watching (and recording history) so a client that
+            # reconnects soon can replay from its token
+            self._idle_handle = self._loop.call_later(self.idle_grace, self._on_idle)
+
+    def _on_idle(self) -> None:
+        self._idle_handle = None
+        if not self._listeners:
+            self._idle_stop = asyncio.ensure_future(self.stop())
+
+    # -- publishing ------------------------------------------------------
+
+    def publish(self, kind: str, path: str, src: Optional[str] = None) -> None:
+        """Queue an API-originated event.
+
+        Callable from any thread; a no-op while nobody is subscribed.
+        """
+        loop = self._loop
+        if loop is None:
+            return
+        ev: Event = {"kind": kind, "path": _norm(path)}
+        if src is not None:
+            ev["src"] = _norm(src)
+        # Taken right after the change, before anyone else can touch the path
+        left = {p: self._signature(p) for p in (ev["path"], ev.get("src")) if p}
+        loop.call_soon_threadsafe(self._add, ev, left)
+
+    def _signature(self, rel: str) -> Signature:
+        try:
+            st = os.stat(self.root / rel)
+        except OSError:
+            return None
+        is_dir = stat.S_ISDIR(st.st_mode)
+        # Directory mtimes change with their children; only track existence
+        return (is_dir, 0 if is_dir else st.st_mtime_ns, 0 if is_dir else st.st_size)
+
+    def _add(self, ev: Event, left: Optional[Dict[str, Signature]] = None) -> None:
+        """Queue ``ev``; ``left`` is what an API change left its paths as."""
+        if not self.running or not ev["path"] or _ignored(ev["path"]):
+            return
+        now = time.monotonic()
+        if left is not None:
+            self._remember_echo(left, now)
+        elif self._is_echo(ev["path"], now):
+            return
+        _coalesce(self._pending, ev)
+        if self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.debounce, self._flush)
+
+    def _remember_echo(self, left: Dict[str, Signature], now: float) -> None:
+        # The watcher will report the same change shortly; remember the state
+        # the API left each path in so that report is not sent twice.
+        if len(self._echo) > 1024:
+            self._echo = {k: v for k, v in self._echo.items() if v[1] > now}
+        for path, sig in left.items():
+            self._echo[path] = (sig, now + ECHO_WINDOW_S)
+
+    def _is_echo(self, path: str, now: float) -> bool:
+        # Only while the path is still as the API left it: a later edit from
+        # anywhere else (an agent, git, the terminal) changes its signature.
+        entry = self._echo.get(path)
+        if entry is None or entry[1] <= now:
+            return False
+        return self._signature(path) == entry[0]
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        events = list(self._pending.values())
+        self._pending.clear()
+        if not events:
+            return
+        for ev in events:
+            if ev["kind"] != DELETED:
+                p = self.root / ev["path"]
+                if p.exists():
+                    ev["dir"] = p.is_dir()
+        self._seq += 1
+        self._history.append((self._seq, events))
+        token = self.token
+        for listener in list(self._listeners):
+            try:
+                listener(token, events)
+            except Exception as exc:
+                # Report it, but keep delivering to everyone else
+                self._loop.call_exception_handler(
+                    {"message": "fs event listener failed", "exception": exc}
+                )
+
+    def replay(self, since: str) -> Optional[List[Tuple[str, List[Event]]]]:
+        """Batches published after ``since``, or ``None`` if a resync is needed."""
+        epoch, _, seq = since.partition(":")
+        if epoch != self._epoch or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        after = int(seq)
+        oldest = self._history[0][0] if self._history else self._seq + 1
+        if after < oldest - 1:
+            return None
+        return [(f"{self._epoch}:{s}", evs) for s, evs in self._history if s > after]
+
+    # -- watchers --------------------------------------------------------
+
+    def _rel(self, path: str) -> str:
+        try:
+            return Path(path).relative_to(self.root).as_posix()
+        except ValueError:
+            return ""
+
+    async def _watch(self) -> None:
+        if self.watcher in ("auto", "kernel"):
+            try:
+                await self._watch_kernel()
+                return
+            except (ImportError, OSError):
+                if self.watcher == "kernel":
+                    raise
+        await self._watch_poll()
+
+    async def _watch_kernel(self) -> None:
+        from watchfiles import Change, awatch
+
+        kinds = {Change.added: CREATED, Change.modified: MODIFIED, Change.deleted: DELETED}
+        self.backend = "kernel"
+        async for changes in awatch(
+            self.root,
+            watch_filter=lambda change, path: not _ignored(self._rel(path)),
+            debounce=int(self.debounce * 1000),
+            step=max(1, int(self.debounce * 1000) // 2),
+        ):
+            for change, path in changes:
+                self._add({"kind": kinds[change], "path": self._rel(path)})
+
+    def _snapshot(self) -> Dict[str, Tuple[bool, int, int]]:
+        snap: Dict[str, Tuple[bool, int, int]] = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS]
+            for name in dirnames + filenames:
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                is_dir = name in dirnames
+                # Directory mtimes change with their children; only track existence
+                snap[self._rel(p)] = (is_dir, 0 if is_dir else st.st_mtime_ns, 0 if is_dir else st.st_size)
+        return snap
+
+    async def _watch_poll(self) -> None:
+        self.backend = "poll"
+        prev = await asyncio.to_thread(self._snapshot)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            cur = await asyncio.to_thread(self._snapshot)
+            for rel in prev.keys() - cur.keys():
+                self._add({"kind": DELETED, "path": rel})
+            for rel, stat in cur.items():
+                old = prev.get(rel)
+                if old is None:
+                    self._add({"kind": CREATED, "path": rel})
+                elif old != stat:
+                    self._add({"kind": MODIFIED, "path": rel})
+            prev = cur
+
+
+def _subscription(sid: str, msg: Dict[str, Any]) -> Optional[Subscription]:
+    """Build a subscription from a ``subscribe`` frame, or ``None`` if malformed."""
+    path = msg.get("path") or ""
+    glob = msg.get("glob") or []
+    if isinstance(glob, str):
+        glob = [glob]
+    if not isinstance(path, str) or not isinstance(glob, list) or not all(isinstance(g, str) for g in glob):
+        return None
+    return Subscription(sid, path, glob)
+
+
+async def serve(ws: WebSocket, hub: FsEventHub) -> None:
+    """Run the ``/ws/fs`` protocol on an accepted WebSocket."""
+    subs: Dict[str, Subscription] = {}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def push(msg: Dict[str, Any]) -> None:
+        try:
+            queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            # The client fell behind: drop what is queued and ask it to
+            # reload every subscription instead.
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"type": "resync", "token": hub.token})
+
+    def on_batch(token: str, events: List[Event]) -> None:
+        for sub in list(subs.values()):
+            matched = sub.filter(events)
+            if matched:
+                push({"type": "events", "id": sub.id, "token": token, "events": matched})
+
+    async def pump():
+        while True:
+            msg = await queue.get()
+            await ws.send_json(msg)
+
+    hub.add_listener(on_batch)
+    sender = asyncio.create_task(pump())
+    try:
+        while True:
+            msg = await ws.receive_json()
+            if not isinstance(msg, dict):
+                continue
+            sid = str(msg.get("id") or "")
+            if msg.get("type") == "subscribe":
+                sub = _subscription(sid, msg)
+                if sub is None:
+                    push({"type": "error", "id": sid, "error": "invalid subscribe"})
+                    continue
+                subs[sid] = sub
+                push({"type": "subscribed", "id": sid, "token": hub.token})
+                since = msg.get("since")
+                if since:
+                    batches = hub.replay(str(since))
+                    if batches is None:
+                        push({"type": "resync", "id": sid, "token": hub.token})
+                    else:
+                        for token, events in batches:
+                            matched = sub.filter(events)
+                            if matched:
+                                push({"type": "events", "id": sid, "token": token, "events": matched})
+            elif msg.get("type") == "unsubscribe":
+                subs.pop(sid, None)
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        sender.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await sender
+        await hub.remove_listener(on_batch)
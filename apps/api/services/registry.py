@@ -0,0 +1,128 @@
+"""Live sessions and terminals that outlive the socket attached to them.
+
+A client that drops and reconnects -- to the same worker, or routed back to
+it as the owner -- reattaches to the running Codex session or shell instead of
+starting a new one. An entry is torn down once no socket has been attached
+for ``grace`` seconds, when its process exits, or on shutdown.
+
+``on_open`` runs before an entry is created and ``on_close`` after it is torn
+down; that is where the worker claims and gives up ownership of the id. Both
+run under one lock, so a reconnect racing a teardown always claims again
+after the old entry's release, never before it.
+
+Entries are any object with a ``done`` :class:`asyncio.Event` (set when the
+underlying process has ended) and an ``async close()``.
+"""
+
+import asyncio
+import contextlib
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+GRACE_S = 30.0
+
+
+class Refused(Exception):
+    """Raised by ``on_open`` when this worker must not create the entry."""
+
+
+class Registry:
+    """Per-worker entries keyed by id, each kept alive while in use."""
+
+    def __init__(
+        self,
+        grace: float = GRACE_S,
+        on_open: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_close: Optional[Callable[[str], Awaitable[None]]] = None,
+    ):
+        self.grace = grace
+        self._on_open = on_open
+        self._on_close = on_close
+        self._entries: Dict[str, Any] = {}
+        self._attached: Dict[str, int] = {}
+        self._expiry: Dict[str, asyncio.Task] = {}
+        self._watchers: Dict[str, asyncio.Task] = {}
+        self._lock = asyncio.Lock()
+
+    def __contains__(self, rid: str) -> bool:
+        return rid in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, rid: str) -> Any:
+        return self._entries.get(rid)
+
+    async def open(self, rid: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the live entry for ``rid``, creating it with ``factory``.
+
+        ``on_open`` may raise :class:`Refused`. If creating the entry fails,
+        ``on_close`` still runs so the id is released.
+        """
+        async with self._lock:
+            entry = self._entries.get(rid)
+            if entry is None:
+                if self._on_open is not None:
+                    await self._on_open(rid)
+                try:
+                    entry = await factory()
+                except BaseException:
+                    if self._on_close is not None:
+                        await self._on_close(rid)
+                    raise
+                self._entries[rid] = entry
+                self._watchers[rid] = asyncio.create_task(self._watch(rid, entry))
+                if not self._attached.get(rid):
+                    self._schedule(rid)
+            return entry
+
+    @contextlib.asynccontextmanager
+    async def attached(self, rid: str):
+        """Hold ``rid`` open for the duration of one socket."""
+        self._attached[rid] = self._attached.get(rid, 0) + 1
+        expiry = self._expiry.pop(rid, None)
+        if expiry is not None:
+            expiry.cancel()
+        try:
+            yield
+        finally:
+            self._attached[rid] -= 1
+            if not self._attached[rid]:
+                del self._attached[rid]
+                if rid in self._entries:
+                    self._schedule(rid)
+
+    def _schedule(self, rid: str) -> None:
+        async def expire():
+            await asyncio.sleep(self.grace)
+            self._expiry.pop(rid, None)
+            await self.close(rid)
+
+        self._expiry[rid] = asyncio.create_task(expire())
+
+    async def _watch(self, rid: str, entry: Any) -> None:
+        await entry.done.wait()
+        self._watchers.pop(rid, None)
+        await self.close(rid, entry)
+
+    async def close(self, rid: str, entry: Any = None) -> None:
+        """Tear down ``rid`` (only if it is still ``entry``, when given)."""
+        async with self._lock:
+            current = self._entries.get(rid)
+            if current is None or (entry is not None and current is not entry):
+                return
+            del self._entries[rid]
+            expiry = self._expiry.pop(rid, None)
+            if expiry is not None:
+                expiry.cancel()
+            try:
+                await current.close()
+            finally:
+                watcher = self._watchers.pop(rid, None)
+                if watcher is not None:
+                    watcher.cancel()
+                if self._on_close is not None:
+                    await self._on_close(rid)
+
+    async def close_all(self) -> None:
+        for rid in list(self._entries):
+            await self.close(rid)
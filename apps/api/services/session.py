@@ -0,0 +1,87 @@
+"""Codex sessions that keep running while no socket is attached.
+
+Prompts are queued and answered one at a time by a background task, so a
+reply keeps streaming if the client drops mid-answer. Frames of the reply in
+flight are kept and replayed to a socket that (re)attaches before it is done.
+Each attached socket has its own codec (see ``services.wire``). At most
+``MAX_PENDING`` prompts wait behind the one being answered; further prompts
+are refused until the queue drains.
+"""
+
+import asyncio
+import contextlib
+from typing import Any, Dict, List, Tuple
+
+from fastapi import WebSocket
+
+from schemas import Out
+from services import wire
+
+MAX_PENDING = 4
+
+
+class Session:
+    def __init__(self, session_id: str, codex: Any):
+        self.session_id = session_id
+        self.done = asyncio.Event()
+        self._codex = codex
+        self._prompts: "asyncio.Queue[Tuple[str, str]]" = asyncio.Queue(maxsize=MAX_PENDING)
+        self._inflight: List[Out] = []
+        self._sockets: Dict[WebSocket, Any] = {}
+        # Keeps the replay ordered with live frames
+        self._lock = asyncio.Lock()
+        self._worker = asyncio.create_task(self._run())
+
+    def submit(self, message_id: str, prompt: str) -> bool:
+        """Queue a prompt; ``False`` if too many are already waiting."""
+        try:
+            self._prompts.put_nowait((message_id, prompt))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    @contextlib.asynccontextmanager
+    async def attached(self, ws: WebSocket, codec: Any):
+        """Stream this session's replies to ``ws`` while the block runs."""
+        async with self._lock:
+            for out in self._inflight:
+                await wire.send(ws, codec, out)
+            self._sockets[ws] = codec
+        try:
+            yield
+        finally:
+            self._sockets.pop(ws, None)
+
+    async def send(self, ws: WebSocket, codec: Any, out: Out) -> None:
+        """Send a frame to one socket, ordered with the session's own frames."""
+        async with self._lock:
+            await wire.send(ws, codec, out)
+
+    async def _emit(self, out: Out) -> None:
+        async with self._lock:
+            self._inflight.append(out)
+            for ws, codec in list(self._sockets.items()):
+                try:
+                    await wire.send(ws, codec, out)
+                except Exception:
+                    self._sockets.pop(ws, None)
+
+    async def _run(self) -> None:
+        while True:
+            message_id, prompt = await self._prompts.get()
+            out = lambda type_, payload: Out(  # noqa: E731
+                type=type_, sessionId=self.session_id, messageId=message_id, payload=payload
+            )
+            try:
+                async for chunk in self._codex.invoke_codex(prompt):
+                    await self._emit(out("partial", {"text": chunk}))
+                await self._emit(out("final", {"done": True}))
+            except Exception as exc:
+                await self._emit(out("error", {"error": str(exc)}))
+            self._inflight.clear()
+
+    async def close(self) -> None:
+        self.done.set()
+        self._worker.cancel()
+        with contextlib.suppress(BaseException):
+            await self._worker
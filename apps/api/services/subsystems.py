@@ -0,0 +1,136 @@
+"""Lazily initialised API subsystems.
+
+Heavy components (the PTY terminal, the Codex adapter and, later, DB/Redis
+clients) are registered here by name with a zero-argument loader instead of
+being imported when ``main`` loads. A subsystem is initialised either on first
+use via :meth:`Subsystems.get` or ahead of time by :meth:`Subsystems.warmup`,
+which the app runs in the background after startup. Its state feeds the
+readiness report on ``/health/ready``.
+"""
+
+import asyncio
+import importlib
+import time
+from typing import Any, Callable, Dict, Optional
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+def import_loader(module: str) -> Callable[[], Any]:
+    """Return a loader that imports ``module`` and hands back the module."""
+
+    def load():
+        return importlib.import_module(module)
+
+    return load
+
+
+class Subsystem:
+    """A single named component that is initialised at most once."""
+
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self._loader = loader
+        self._lock = asyncio.Lock()
+        self.state = PENDING
+        self.value: Any = None
+        self.error: Optional[str] = None
+        self.load_ms: Optional[float] = None
+
+    async def get(self) -> Any:
+        if self.state == READY:
+            return self.value
+        async with self._lock:
+            if self.state != READY:
+                self.state = LOADING
+                started = time.perf_counter()
+                try:
+                    # Loaders may import modules or open connections; keep
+                    # the event loop responsive while they run.
+                    self.value = await asyncio.to_thread(self._loader)
+                except Exception as exc:
+                    self.state = FAILED
+                    self.error = f"{type(exc).__name__}: {exc}"
+                    raise
+                self.load_ms = round((time.perf_counter() - started) * 1000, 1)
+                self.state = READY
+                self.error = None
+        return self.value
+
+    def report(self, error: Optional[BaseException]) -> None:
+        """Record the outcome of a later health check on a loaded subsystem.
+
+        A failure takes it out of readiness (and the next :meth:`get` runs the
+        loader again); a success after a failure restores it.
+        """
+        if error is not None:
+            self.state = FAILED
+            self.error = f"{type(error).__name__}: {error}"
+        elif self.state == FAILED and self.load_ms is not None:
+            self.state = READY
+            self.error = None
+
+    def status(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"state": self.state}
+        if self.load_ms is not None:
+            out["loadMs"] = self.load_ms
+        if self.error:
+            out["error"] = self.error
+        return out
+
+
+class Subsystems:
+    """Registry of :class:`Subsystem` objects attached to an app instance."""
+
+    def __init__(self):
+        self._items: Dict[str, Subsystem] = {}
+        self._warmup: Optional[asyncio.Task] = None
+
+    def register(self, name: str, loader: Callable[[], Any]) -> Subsystem:
+        if name in self._items:
+            raise ValueError(f"Subsystem already registered: {name}")
+        sub = Subsystem(name, loader)
+        self._items[name] = sub
+        return sub
+
+    async def get(self, name: str) -> Any:
+        try:
+            sub = self._items[name]
+        except KeyError:
+            raise KeyError(f"Unknown subsystem: {name}") from None
+        return await sub.get()
+
+    def report(self, name: str, error: Optional[BaseException] = None) -> None:
+        self._items[name].report(error)
+
+    async def _warm_all(self) -> None:
+        for sub in self._items.values():
+            try:
+                await sub.get()
+            except Exception:
+                # Recorded on the subsystem and surfaced via readiness
+                continue
+
+    def start_warmup(self) -> asyncio.Task:
+        """Initialise every subsystem in a background task (idempotent)."""
+        if self._warmup is None:
+            self._warmup = asyncio.create_task(self._warm_all())
+        return self._warmup
+
+    async def stop(self) -> None:
+        if self._warmup is not None and not self._warmup.done():
+            self._warmup.cancel()
+            try:
+                await self._warmup
+            except asyncio.CancelledError:
+                pass
+
+    @property
+    def ready(self) -> bool:
+        return all(sub.state == READY for sub in self._items.values())
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {name: sub.status() for name, sub in self._items.items()}
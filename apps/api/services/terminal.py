@@ -0,0 +1,256 @@
+"""Shell sessions proxied over a WebSocket.
+
+This module pulls in the POSIX PTY machinery, so ``main`` only imports it the
+first time a terminal is opened (or during background warmup).
+
+A :class:`Terminal` is independent of any one socket: sockets attach and
+detach, and a reattaching client is sent recent output so its screen can be
+redrawn. ``main`` keeps named terminals in a registry; anonymous ones are
+closed when their socket goes away (see :func:`run_terminal`).
+"""
+
+import abc
+import asyncio
+import contextlib
+import json
+import os
+import signal
+from typing import Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+# Optional PTY deps for POSIX
+try:  # pragma: no cover - platform specific
+    import pty  # type: ignore
+    import fcntl  # type: ignore
+    import struct  # type: ignore
+    POSIX = os.name != "nt"
+except Exception:  # pragma: no cover
+    pty = None  # type: ignore
+    fcntl = None  # type: ignore
+    struct = None  # type: ignore
+    POSIX = False
+
+# Output kept for clients that reattach (characters)
+SCROLLBACK = 64 * 1024
+
+
+class Terminal(abc.ABC):
+    """A running shell and the sockets currently attached to it.
+
+    Client messages:
+      {"type":"input","data":"..."}
+      {"type":"resize","cols":80,"rows":24}
+
+    Server messages:
+      {"type":"output","data":"..."}
+    """
+
+    def __init__(self):
+        self.done = asyncio.Event()
+        self._sockets: Set[WebSocket] = set()
+        self._scrollback = ""
+        # Keeps the scrollback replay ordered with live output
+        self._lock = asyncio.Lock()
+        self._reader: Optional[asyncio.Task] = None
+
+    async def attach(self, ws: WebSocket) -> None:
+        """Serve an accepted socket until it disconnects or the shell exits."""
+        async with self._lock:
+            if self._scrollback:
+                await ws.send_text(json.dumps({"type": "output", "data": self._scrollback}))
+            self._sockets.add(ws)
+        exited = asyncio.create_task(self.done.wait())
+        try:
+            while True:
+                receive = asyncio.create_task(ws.receive_text())
+                await asyncio.wait({receive, exited}, return_when=asyncio.FIRST_COMPLETED)
+                if not receive.done():
+                    receive.cancel()
+                    with contextlib.suppress(Exception):
+                        await ws.close()
+                    return
+                msg = receive.result()
+                try:
+                    ev = json.loads(msg)
+                except json.JSONDecodeError:
+                    ev = {"type": "input", "data": msg}
+
+                if ev.get("type") == "input":
+                    data = ev.get("data", "")
+                    if data:
+                        await self.write(data.encode())
+                elif ev.get("type") == "resize":
+                    try:
+                        await self.resize(int(ev.get("cols", 80)), int(ev.get("rows", 24)))
+                    except Exception:
+                        # Ignore resize errors
+                        pass
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            exited.cancel()
+            self._sockets.discard(ws)
+
+    async def _output(self, data: bytes) -> None:
+        text = data.decode(errors="ignore")
+        async with self._lock:
+            self._scrollback = (self._scrollback + text)[-SCROLLBACK:]
+            frame = json.dumps({"type": "output", "data": text})
+            for ws in list(self._sockets):
+                try:
+                    await ws.send_text(frame)
+                except Exception:
+                    self._sockets.discard(ws)
+
+    @abc.abstractmethod
+    async def write(self, data: bytes) -> None:
+        """Send input to the shell."""
+
+    async def resize(self, cols: int, rows: int) -> None:
+        # No PTY configured on this path
+        pass
+
+    async def close(self) -> None:
+        self.done.set()
+        if self._reader is not None:
+            self._reader.cancel()
+            with contextlib.suppress(BaseException):
+                await self._reader
+
+
+class _PtyTerminal(Terminal):
+    # PTY-backed shell on POSIX
+
+    def __init__(self, cwd: str):
+        super().__init__()
+        shell = os.environ.get("SHELL") or ("/bin/bash" if os.path.exists("/bin/bash") else "/bin/sh")
+
+        # Fork a child connected to a pty
+        pid, master_fd = pty.fork()  # type: ignore[attr-defined]
+        if pid == 0:  # Child
+            # Optional: chdir to project root
+            try:
+                os.chdir(cwd)
+            except Exception:
+                pass
+            os.execvp(shell, [shell])
+            os._exit(1)
+        self.pid = pid
+        self._fd = master_fd
+        # Read from the event loop rather than a worker thread: a thread
+        # blocked in os.read would outlive the shell and stall shutdown.
+        self._chunks: "asyncio.Queue[bytes]" = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(master_fd, self._readable)
+        self._reader = asyncio.create_task(self._pump())
+
+    def _readable(self) -> None:
+        try:
+            data = os.read(self._fd, 1024)
+        except OSError:
+            data = b""
+        if not data:
+            # EOF (or EIO once the shell has exited)
+            self._loop.remove_reader(self._fd)
+        self._chunks.put_nowait(data)
+
+    async def _pump(self) -> None:
+        try:
+            while True:
+                data = await self._chunks.get()
+                if not data:
+                    break
+                await self._output(data)
+        except Exception:
+            pass
+        finally:
+            self.done.set()
+
+    async def write(self, data: bytes) -> None:
+        with contextlib.suppress(Exception):
+            await asyncio.to_thread(os.write, self._fd, data)
+
+    async def resize(self, cols: int, rows: int) -> None:
+        if fcntl is not None and struct is not None:
+            winsz = struct.pack("HHHH", rows, cols, 0, 0)
+            await asyncio.to_thread(fcntl.ioctl, self._fd, 0x5414, winsz)  # TIOCSWINSZ
+
+    async def close(self) -> None:
+        with contextlib.suppress(Exception):
+            self._loop.remove_reader(self._fd)
+        with contextlib.suppress(Exception):
+            # Hang up, as closing a terminal window would; interactive
+            # shells ignore SIGTERM
+            os.kill(self.pid, signal.SIGHUP)
+        with contextlib.suppress(Exception):
+            os.close(self._fd)
+        await super().close()
+
+
+class _PipeTerminal(Terminal):
+    # Windows or fallback: subprocess with pipes
+
+    def __init__(self, proc: asyncio.subprocess.Process):
+        super().__init__()
+        self._proc = proc
+        self._reader = asyncio.create_task(self._pump())
+
+    async def _pump(self) -> None:
+        assert self._proc.stdout is not None
+        try:
+            while True:
+                data = await self._proc.stdout.read(1024)
+                if not data:
+                    break
+                await self._output(data)
+        except Exception:
+            pass
+        finally:
+            self.done.set()
+
+    async def write(self, data: bytes) -> None:
+        stdin = self._proc.stdin
+        if stdin is not None and not stdin.is_closing():
+            stdin.write(data)
+            with contextlib.suppress(Exception):
+                await stdin.drain()
+
+    async def close(self) -> None:
+        proc = self._proc
+        with contextlib.suppress(Exception):
+            if proc.stdin and not proc.stdin.is_closing():
+                proc.stdin.write(b"exit\n")
+                await proc.stdin.drain()
+        with contextlib.suppress(Exception):
+            proc.terminate()  # type: ignore[attr-defined]
+        with contextlib.suppress(Exception):
+            await proc.wait()
+        await super().close()
+
+
+async def open_terminal(cwd: str) -> Terminal:
+    """Spawn a shell in ``cwd``."""
+    if POSIX and pty is not None:
+        return _PtyTerminal(cwd)
+
+    if os.name == "nt":
+        cmd = ["powershell.exe", "-NoLogo"]
+    else:
+        cmd = ["/bin/bash"] if os.path.exists("/bin/bash") else ["/bin/sh"]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    return _PipeTerminal(proc)
+
+
+async def run_terminal(ws: WebSocket, cwd: str) -> None:
+    """Spawn a shell in ``cwd`` for one accepted WebSocket, then close it."""
+    terminal = await open_terminal(cwd)
+    try:
+        await terminal.attach(ws)
+    finally:
+        await terminal.close()
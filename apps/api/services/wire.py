@@ -0,0 +1,185 @@
+"""Wire encodings for the ``/ws/session/{id}`` envelope.
+
+``schemas.Out`` and ``schemas.In`` remain the canonical message shapes; the
+codecs here only change how those fields are laid out on the wire. A client
+picks an encoding by offering a WebSocket subprotocol:
+
+``codex.v1.json``
+    The full JSON ``Out`` object (also the default when nothing is offered).
+``codex.v1.compact``
+    Short-key JSON frames: ``{"t": type, "m": id, "p": payload}``.
+``codex.v1.msgpack``
+    The same short-key frame packed with MessagePack and sent as binary.
+
+In the compact encodings ``sessionId`` is never sent (it is fixed by the URL)
+and ``type`` is an index into :data:`EVENT_TYPES` when it is a known event.
+Message IDs are interned per connection, and only the server assigns the
+numbers: the first server frame for a message carries the full id in ``"M"``
+alongside its number ``"m"``; later frames only carry ``"m"``. Client frames
+use the same keys and send either a new id in ``"M"`` or an ``"m"`` the server
+has already announced.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Union
+
+import msgpack
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic_core import to_json
+
+from schemas import Out
+
+JSON = "codex.v1.json"
+COMPACT = "codex.v1.compact"
+MSGPACK = "codex.v1.msgpack"
+
+# Mirrors SessionEventSchema.type in packages/shared/src/schemas.ts; the order
+# is part of the protocol, so only ever append.
+EVENT_TYPES = ("event", "partial", "final", "tool_request", "tool_result", "error")
+_TYPE_CODES = {t: i for i, t in enumerate(EVENT_TYPES)}
+
+Frame = Union[str, bytes]
+
+
+def _event(ev: Any) -> Optional[Dict[str, Any]]:
+    """Normalise a decoded client event, or ``None`` if it is not an object.
+
+    ``payload`` is always a dict and ``messageId``, when present, a string.
+    """
+    if not isinstance(ev, dict):
+        return None
+    if not isinstance(ev.get("payload"), dict):
+        ev["payload"] = {}
+    if "messageId" in ev and not isinstance(ev["messageId"], str):
+        del ev["messageId"]
+    return ev
+
+
+class JsonCodec:
+    """Full JSON ``Out`` objects; the original protocol."""
+
+    subprotocol: Optional[str] = JSON
+
+    def encode(self, out: Out) -> Frame:
+        return out.model_dump_json()
+
+    def decode(self, data: Frame) -> Optional[Dict[str, Any]]:
+        return _event(json.loads(data))
+
+
+class CompactCodec:
+    """Short-key frames with interned message ids, serialised as JSON.
+
+    ``assign`` is true on the server, which numbers message ids. A client-side
+    codec (``assign=False``) only learns the numbers the server announces.
+    """
+
+    subprotocol: Optional[str] = COMPACT
+
+    def __init__(self, assign: bool = True):
+        self.assign = assign
+        self._ids: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+
+    def _intern(self, message_id: str, frame: Dict[str, Any]) -> None:
+        num = self._ids.get(message_id)
+        if num is None:
+            frame["M"] = message_id
+            if not self.assign:
+                return
+            num = len(self._ids)
+            self._ids[message_id] = num
+            self._names[num] = message_id
+        frame["m"] = num
+
+    def pack(self, out: Out) -> Dict[str, Any]:
+        frame: Dict[str, Any] = {"t": _TYPE_CODES.get(out.type, out.type)}
+        self._intern(out.messageId, frame)
+        frame["p"] = out.payload
+        return frame
+
+    def unpack(self, frame: Any) -> Optional[Dict[str, Any]]:
+        if not isinstance(frame, dict):
+            return None
+        t = frame.get("t")
+        ev: Dict[str, Any] = {
+            "type": EVENT_TYPES[t] if isinstance(t, int) and 0 <= t < len(EVENT_TYPES) else t,
+            "payload": frame.get("p"),
+        }
+        num = frame.get("m")
+        if frame.get("M"):
+            ev["messageId"] = frame["M"]
+            # Only the server numbers ids; a client-sent "m" is ignored
+            if not self.assign and isinstance(num, int) and isinstance(frame["M"], str):
+                self._ids[frame["M"]] = num
+                self._names[num] = frame["M"]
+        elif isinstance(num, int) and num in self._names:
+            ev["messageId"] = self._names[num]
+        return _event(ev)
+
+    def encode(self, out: Out) -> Frame:
+        # pydantic's serializer is several times faster than json.dumps here
+        return to_json(self.pack(out)).decode()
+
+    def decode(self, data: Frame) -> Optional[Dict[str, Any]]:
+        return self.unpack(json.loads(data))
+
+
+class MsgpackCodec(CompactCodec):
+    """Short-key frames with interned message ids, packed with MessagePack."""
+
+    subprotocol: Optional[str] = MSGPACK
+
+    def encode(self, out: Out) -> Frame:
+        return msgpack.packb(self.pack(out), use_bin_type=True)
+
+    def decode(self, data: Frame) -> Optional[Dict[str, Any]]:
+        if isinstance(data, str):
+            data = data.encode()
+        return self.unpack(msgpack.unpackb(data, raw=False))
+
+
+def negotiate(offered: List[str]):
+    """Return a fresh server-side codec for the first offered subprotocol.
+
+    Clients list subprotocols in order of preference. Without a match the
+    connection falls back to plain JSON and no subprotocol is echoed back.
+    """
+    for proto in offered:
+        if proto == MSGPACK:
+            return MsgpackCodec()
+        if proto == COMPACT:
+            return CompactCodec()
+        if proto == JSON:
+            return JsonCodec()
+    codec = JsonCodec()
+    codec.subprotocol = None
+    return codec
+
+
+async def send(ws: WebSocket, codec, out: Out) -> None:
+    frame = codec.encode(out)
+    if isinstance(frame, bytes):
+        await ws.send_bytes(frame)
+    else:
+        await ws.send_text(frame)
+
+
+async def receive(ws: WebSocket, codec) -> Dict[str, Any]:
+    """Receive the next client event (text or binary frame) and decode it.
+
+    Frames that do not decode to an object are skipped.
+    """
+    while True:
+        message = await ws.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        data = message.get("bytes")
+        if data is None:
+            data = message.get("text") or ""
+        try:
+            ev = codec.decode(data)
+        except (ValueError, msgpack.UnpackException):
+            continue
+        if ev is not None:
+            return ev
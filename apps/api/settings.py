@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -12,8 +14,24 @@ class Settings(BaseSettings):
     codex_command: str = Field("", alias="CODEX_COMMAND")
     cors_origin: str = Field("http://localhost:3000", alias="CORS_ORIGIN")
     api_port: int = Field(5050, alias="API_PORT")
+    # Multi-worker deployments: "memory" (single process) or "redis"
+    coordination: str = Field("memory", alias="COORDINATION")
+    worker_url: str = Field("", alias="WORKER_URL")
+    cache_ttl: float = Field(0.0, alias="CACHE_TTL")  # /api/fs/tree, 0 = off
+    session_rate_limit: int = Field(0, alias="SESSION_RATE_LIMIT")  # prompts/min, 0 = off
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 
-settings = Settings(_secrets_dir=None)
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Parse the environment (and ``.env``) once, on first use."""
+    return Settings(_secrets_dir=None)
+
+
+def __getattr__(name: str):
+    # ``from settings import settings`` keeps working, but the environment is
+    # only parsed when something actually asks for it.
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,38 @@
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+API_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(API_DIR))
+
+
+@pytest.fixture()
+def settings(tmp_path, monkeypatch):
+    """Stand-in for ``settings.settings`` with the project rooted at ``tmp_path``.
+
+    Tests may change fields before building an app.
+    """
+    values = types.SimpleNamespace(
+        project_root=str(tmp_path),
+        cors_origin="http://localhost:3000",
+        coordination="memory",
+        worker_url="",
+        cache_ttl=0.0,
+        session_rate_limit=0,
+    )
+    module = types.ModuleType("settings")
+    module.settings = values
+    monkeypatch.setitem(sys.modules, "settings", module)
+    # Re-imported by create_app against this module
+    sys.modules.pop("routers.fs", None)
+    return values
+
+
+@pytest.fixture()
+def main(settings):
+    """The ``main`` module, with :func:`settings` in place."""
+    import main
+
+    return main
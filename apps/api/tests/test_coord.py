@@ -0,0 +1,490 @@
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi import WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from services.coord import Coordinator, InMemoryStore
+
+API_DIR = Path(__file__).resolve().parents[1]
+
+
+def _pair(**kw):
+    store = InMemoryStore()
+    a = Coordinator(store, "a", "http://a:1", **kw)
+    b = Coordinator(store, "b", "http://b:1", **kw)
+    a.heartbeat()
+    b.heartbeat()
+    return a, b
+
+
+def test_ownership_is_shared():
+    a, b = _pair()
+    assert a.claim("session", "s1") == a.me
+    assert b.claim("session", "s1") == a.me
+    # Claims are idempotent; one release gives the id up
+    assert a.claim("session", "s1") == a.me
+    a.release("session", "s1")
+    assert b.claim("session", "s1") == b.me
+
+
+def test_dead_owner_is_taken_over():
+    a, b = _pair()
+    a.claim("terminal", "t1")
+    # Worker a stops heartbeating and its registration expires
+    a.store.delete("worker:a")
+    assert b.claim("terminal", "t1") == b.me
+    # a's late release must not drop b's claim
+    a.release("terminal", "t1")
+    assert a.claim("terminal", "t1") == b.me
+
+
+def test_takeover_from_dead_owner_has_one_winner():
+    store = InMemoryStore()
+    dead = Coordinator(store, "dead", "http://dead:1")
+    dead.claim("terminal", "t1")
+    rivals = [Coordinator(store, f"w{i}", f"http://w{i}:1") for i in range(8)]
+    for r in rivals:
+        r.heartbeat()
+
+    barrier = threading.Barrier(len(rivals))
+
+    def race(c):
+        barrier.wait()
+        return c.claim("terminal", "t1") == c.me
+
+    with ThreadPoolExecutor(len(rivals)) as pool:
+        wins = list(pool.map(race, rivals))
+    assert wins.count(True) == 1
+
+
+def test_forced_claims_need_the_shared_secret():
+    a, b = _pair()
+    a.claim("session", "s1")
+    assert not b.is_forwarded(None)
+    assert not b.is_forwarded("a")  # a worker id is not enough
+    # Every worker on the store agrees on the secret
+    assert b.is_forwarded(a.forward_token())
+
+
+def test_in_memory_store_sweeps_expired_keys():
+    store = InMemoryStore()
+    c = Coordinator(store, cache_ttl=0.001)
+    for _ in range(1000):
+        c.cached("fs:tree:", lambda: ["x"] * 10, generation="fs")
+        c.bump("fs")
+    time.sleep(0.01)
+    for _ in range(InMemoryStore.SWEEP_EVERY):
+        store.incr("n")
+    assert len(store._data) <= InMemoryStore.SWEEP_EVERY
+
+
+def test_unroutable_workers_serve_locally():
+    store = InMemoryStore()
+    a = Coordinator(store, "a")
+    b = Coordinator(store, "b")
+    assert a.claim("session", "s1") == a.me
+    assert b.claim("session", "s1") == b.me
+
+
+def test_rate_limit_and_cache_are_shared():
+    a, b = _pair(cache_ttl=60)
+    assert a.hit("s", 2) and b.hit("s", 2)
+    assert not a.hit("s", 2)
+
+    calls = []
+    compute = lambda: calls.append(1) or ["x"]  # noqa: E731
+    assert a.cached("k", compute, generation="fs") == ["x"]
+    assert b.cached("k", compute, generation="fs") == ["x"]
+    assert len(calls) == 1
+    b.bump("fs")
+    a.cached("k", compute, generation="fs")
+    assert len(calls) == 2
+
+
+def test_reopen_during_teardown_keeps_ownership():
+    from services.registry import Registry
+
+    c = Coordinator(InMemoryStore(), "w", "http://w:1")
+
+    class Entry:
+        def __init__(self):
+            self.done = asyncio.Event()
+
+        async def close(self):
+            await asyncio.sleep(0.02)
+
+    async def make():
+        return Entry()
+
+    async def claim(rid):
+        c.claim("terminal", rid)
+
+    async def release(rid):
+        c.release("terminal", rid)
+
+    async def scenario():
+        registry = Registry(grace=60, on_open=claim, on_close=release)
+        await registry.open("t1", make)
+        closing = asyncio.create_task(registry.close("t1"))
+        await asyncio.sleep(0)
+        # A reconnect arrives mid-teardown and opens a fresh entry
+        assert "t1" not in registry
+        await registry.open("t1", make)
+        await closing
+        assert "t1" in registry
+        held = c.store.get("own:terminal:t1")
+        await registry.close_all()
+        return held
+
+    assert asyncio.run(scenario()) == "w http://w:1"
+    assert c.store.get("own:terminal:t1") is None
+
+
+class BrokenStore:
+    """A store whose backend is down: every call fails."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            self.calls += 1
+            raise ConnectionError("store unreachable")
+
+        return fail
+
+
+def test_cache_off_never_touches_the_store():
+    store = BrokenStore()
+    c = Coordinator(store)
+    assert c.cached("k", lambda: ["x"], generation="fs") == ["x"]
+    c.bump("fs")
+    assert store.calls == 0
+
+
+def test_cache_degrades_when_the_store_is_down():
+    c = Coordinator(BrokenStore(), cache_ttl=60)
+    assert c.cached("k", lambda: ["x"], generation="fs") == ["x"]
+    c.bump("fs")
+
+
+def test_tree_cache_invalidated_by_api_writes(main):
+    c = Coordinator(InMemoryStore(), cache_ttl=60)
+    with TestClient(main.create_app(warmup=False, coordinator=c)) as client:
+        assert client.get("/api/fs/tree").json() == []
+        client.post("/api/fs/write", json={"path": "a.txt", "content": "hi"})
+        assert client.get("/api/fs/tree").json() == ["a.txt"]
+
+
+def test_tree_cache_is_per_app(main):
+    coordinators = [Coordinator(InMemoryStore(), cache_ttl=60) for _ in range(2)]
+    apps = [main.create_app(warmup=False, coordinator=c) for c in coordinators]
+    with TestClient(apps[0]) as a, TestClient(apps[1]) as b:
+        assert a.get("/api/fs/tree").json() == b.get("/api/fs/tree").json() == []
+        # The write invalidates the cache of the app that served it
+        a.post("/api/fs/write", json={"path": "a.txt", "content": "hi"})
+        assert a.get("/api/fs/tree").json() == ["a.txt"]
+    assert [c.generation("fs") for c in coordinators] == ["1", "0"]
+
+
+def test_tree_cache_off_by_default(main, tmp_path):
+    with TestClient(main.create_app(warmup=False)) as client:
+        assert client.get("/api/fs/tree").json() == []
+        (tmp_path / "outside.txt").write_text("x")
+        assert client.get("/api/fs/tree").json() == ["outside.txt"]
+
+
+def test_tree_served_uncached_when_the_store_is_down(main):
+    c = Coordinator(BrokenStore(), cache_ttl=60)
+    with TestClient(main.create_app(warmup=False, coordinator=c)) as client:
+        assert client.post("/api/fs/write", json={"path": "a.txt", "content": "hi"}).status_code == 200
+        assert client.get("/api/fs/tree").json() == ["a.txt"]
+
+
+def test_sockets_refused_and_not_ready_when_the_store_is_down(main):
+    c = Coordinator(BrokenStore(), "w", "http://127.0.0.1:1")
+    with TestClient(main.create_app(warmup=False, coordinator=c)) as client:
+        with pytest.raises(WebSocketDisconnect) as exc:
+            with client.websocket_connect("/ws/session/s1"):
+                pass
+        assert exc.value.code == 1013
+        resp = client.get("/health/ready")
+        assert resp.status_code == 503
+        status = resp.json()["subsystems"]["coordination"]
+        assert status["state"] == "failed" and "unreachable" in status["error"]
+
+
+def test_session_rate_limit(main, settings, monkeypatch):
+    settings.session_rate_limit = 1
+    from services import codex_adapter
+
+    async def fake_codex(prompt):
+        yield "ok"
+
+    monkeypatch.setattr(codex_adapter, "invoke_codex", fake_codex)
+    with TestClient(main.create_app(warmup=False)) as client:
+        with client.websocket_connect("/ws/session/s1") as ws:
+            ws.send_json({"messageId": "m1", "payload": {"text": "hi"}})
+            assert ws.receive_json()["type"] == "partial"
+            assert ws.receive_json()["type"] == "final"
+            ws.send_json({"messageId": "m2", "payload": {"text": "again"}})
+            msg = ws.receive_json()
+            assert msg["type"] == "error" and msg["payload"] == {"error": "rate_limited"}
+
+
+def test_session_reattaches_to_reply_in_flight(main, monkeypatch):
+    from services import codex_adapter
+
+    gate = threading.Event()
+
+    async def fake_codex(prompt):
+        yield "a"
+        while not gate.is_set():
+            await asyncio.sleep(0.01)
+        yield "b"
+
+    monkeypatch.setattr(codex_adapter, "invoke_codex", fake_codex)
+    app = main.create_app(warmup=False)
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws/session/s1") as ws:
+            ws.send_json({"messageId": "m1", "payload": {"text": "hi"}})
+            assert ws.receive_json()["payload"] == {"text": "a"}
+        # The reply keeps going without a socket; a reconnect picks it up
+        with client.websocket_connect("/ws/session/s1") as ws:
+            assert ws.receive_json()["payload"] == {"text": "a"}
+            gate.set()
+            assert ws.receive_json()["payload"] == {"text": "b"}
+            assert ws.receive_json()["type"] == "final"
+        assert len(app.state.sessions) == 1
+
+
+def test_terminal_reattaches_until_grace_expires(main):
+    app = main.create_app(warmup=False)
+
+    def read_until(ws, text):
+        out = ""
+        while text not in out:
+            out += ws.receive_json()["data"]
+        return out
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws/terminal?id=t1") as ws:
+            ws.send_json({"type": "input", "data": "export MARK=41\n"})
+        with client.websocket_connect("/ws/terminal?id=t1") as ws:
+            # Scrollback first, then the same shell
+            assert "MARK=41" in read_until(ws, "MARK=41")
+            ws.send_json({"type": "input", "data": "echo $((MARK+1))\n"})
+            read_until(ws, "42")
+
+        app.state.terminals.grace = 0.05
+        with client.websocket_connect("/ws/terminal?id=t1"):
+            pass
+        deadline = time.monotonic() + 5
+        while "t1" in app.state.terminals:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        # Tearing the shell down gave up ownership
+        assert app.state.coord.store.get("own:terminal:t1") is None
+
+
+def test_session_refuses_prompts_beyond_its_queue(main, monkeypatch):
+    from services import codex_adapter, session
+
+    gate = threading.Event()
+
+    async def fake_codex(prompt):
+        while not gate.is_set():
+            await asyncio.sleep(0.01)
+        yield prompt
+
+    monkeypatch.setattr(codex_adapter, "invoke_codex", fake_codex)
+    monkeypatch.setattr(session, "MAX_PENDING", 1)
+    with TestClient(main.create_app(warmup=False)) as client:
+        with client.websocket_connect("/ws/session/s1") as ws:
+            for i in range(3):
+                ws.send_json({"messageId": f"m{i}", "payload": {"text": str(i)}})
+            # m0 is being answered and m1 waits; m2 does not fit
+            msg = ws.receive_json()
+            assert msg["messageId"] == "m2" and msg["payload"] == {"error": "busy"}
+            gate.set()
+            assert [ws.receive_json()["messageId"] for _ in range(4)] == ["m0", "m0", "m1", "m1"]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture()
+def owner_worker(main, monkeypatch):
+    """A second worker served over real sockets, sharing one in-memory store."""
+    uvicorn = pytest.importorskip("uvicorn")
+    pytest.importorskip("websockets")
+    from services import codex_adapter
+
+    async def fake_codex(prompt):
+        for chunk in ["a", "b"]:
+            yield chunk
+
+    monkeypatch.setattr(codex_adapter, "invoke_codex", fake_codex)
+
+    store = InMemoryStore()
+    port = _free_port()
+    owner = Coordinator(store, "owner", f"http://127.0.0.1:{port}")
+    server = uvicorn.Server(
+        uvicorn.Config(main.create_app(warmup=False, coordinator=owner), port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    local = Coordinator(store, "local", "http://127.0.0.1:1")
+    try:
+        yield main, owner, local
+    finally:
+        server.should_exit = True
+        thread.join(5)
+
+
+def test_socket_forwarded_to_owning_worker(owner_worker):
+    from services import wire
+
+    main, owner, local = owner_worker
+    owner.claim("session", "s1")
+    with TestClient(main.create_app(warmup=False, coordinator=local)) as client:
+        with client.websocket_connect("/ws/session/s1", subprotocols=[wire.COMPACT]) as ws:
+            assert ws.accepted_subprotocol == wire.COMPACT
+            ws.send_text('{"t":0,"M":"m1","p":{"text":"hi"}}')
+            frames = [ws.receive_json() for _ in range(3)]
+            # Served by the owner, which keeps its claim
+            assert "own:session:s1" in owner._owned
+            assert local._owned == set()
+    assert frames[0] == {"t": 1, "M": "m1", "m": 0, "p": {"text": "a"}}
+    assert frames[-1]["t"] == 2
+
+
+def test_unreachable_owner_closes_socket(main):
+    store = InMemoryStore()
+    gone = Coordinator(store, "gone", f"http://127.0.0.1:{_free_port()}")
+    gone.heartbeat()
+    gone.claim("terminal", "t1")
+    local = Coordinator(store, "local", "http://127.0.0.1:1")
+    with TestClient(main.create_app(warmup=False, coordinator=local)) as client:
+        with pytest.raises(WebSocketDisconnect) as exc:
+            with client.websocket_connect("/ws/terminal?id=t1"):
+                pass
+    assert exc.value.code == 1013
+
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+
+def _redis_available():
+    try:
+        import redis
+
+        return redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5).ping()
+    except Exception:
+        return False
+
+
+@contextlib.contextmanager
+def _workers(project_root, count):
+    """``count`` single-worker processes sharing Redis, each addressable."""
+    ports = [_free_port() for _ in range(count)]
+    procs = []
+    try:
+        for port in ports:
+            env = dict(
+                os.environ,
+                PROJECT_ROOT=str(project_root),
+                COORDINATION="redis",
+                REDIS_URL=REDIS_URL,
+                WORKER_URL=f"http://127.0.0.1:{port}",
+                CACHE_TTL="0",
+                SESSION_RATE_LIMIT="0",
+                # Echo prompts back so a reply costs a subprocess, not a sleep
+                CODEX_COMMAND="cat",
+            )
+            procs.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "--factory", "main:create_app",
+                 "--port", str(port), "--log-level", "warning"],
+                cwd=API_DIR,
+                env=env,
+            ))
+        bases = [f"127.0.0.1:{port}" for port in ports]
+        deadline = time.monotonic() + 30
+        for base in bases:
+            while True:
+                try:
+                    if httpx.get(f"http://{base}/health").status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                assert time.monotonic() < deadline, "workers did not start"
+                time.sleep(0.1)
+        yield bases
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait(10)
+
+
+def _throughput(project_root, workers, seconds=3.0, clients=16):
+    """Requests per second over tree listings and routed session sockets."""
+    from websockets.sync.client import connect
+
+    run = uuid.uuid4().hex[:8]
+    with _workers(project_root, workers) as bases:
+        stop = time.monotonic() + seconds
+
+        def hammer(i):
+            n = 0
+            with httpx.Client() as http:
+                while time.monotonic() < stop:
+                    # Rotate through the workers, so most session sockets
+                    # land away from their owner and are forwarded
+                    base = bases[(i + n) % len(bases)]
+                    http.get(f"http://{base}/api/fs/tree").raise_for_status()
+                    with connect(f"ws://{base}/ws/session/{run}-{i}") as ws:
+                        ws.send(json.dumps({"messageId": f"m{n}", "payload": {"text": "hi\n"}}))
+                        while json.loads(ws.recv())["type"] != "final":
+                            pass
+                    n += 2
+            return n
+
+        with ThreadPoolExecutor(clients) as pool:
+            total = sum(pool.map(hammer, range(clients)))
+    return total / seconds
+
+
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason="needs at least two cores")
+@pytest.mark.skipif(not _redis_available(), reason="needs Redis at REDIS_URL")
+def test_throughput_scales_with_workers(tmp_path):
+    pytest.importorskip("websockets")
+    # A wide, mostly empty tree keeps each request CPU-bound on the server
+    # while responses stay small, so the client is not the bottleneck.
+    for i in range(40):
+        for j in range(40):
+            (tmp_path / f"d{i}" / f"e{j}").mkdir(parents=True)
+    (tmp_path / "d0" / "f.txt").write_text("x")
+
+    workers = min(4, os.cpu_count() or 1)
+    single = _throughput(tmp_path, 1)
+    multi = _throughput(tmp_path, workers)
+    assert multi > 1.3 * single, (single, multi)
@@ -0,0 +1,230 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services import fs_events
+from services.fs_events import FsEventHub, Subscription, _coalesce
+
+
+def _fold(*events):
+    pending = {}
+    for ev in events:
+        _coalesce(pending, dict(ev))
+    return list(pending.values())
+
+
+def test_coalesce():
+    c = {"kind": "created", "path": "a"}
+    m = {"kind": "modified", "path": "a"}
+    d = {"kind": "deleted", "path": "a"}
+
+    assert _fold(c, m, m) == [c]
+    assert _fold(c, m, d) == []
+    assert _fold(d, c) == [m]
+    assert _fold(m, d) == [d]
+    assert _fold(c, {"kind": "moved", "path": "b", "src": "a"}) == [{"kind": "created", "path": "b"}]
+    assert _fold(
+        {"kind": "moved", "path": "b", "src": "a"},
+        {"kind": "moved", "path": "c", "src": "b"},
+    ) == [{"kind": "moved", "path": "c", "src": "a"}]
+    assert _fold({"kind": "moved", "path": "b", "src": "a"}, {"kind": "deleted", "path": "b"}) == [d]
+
+
+def test_subscription_filters():
+    sub = Subscription("s", path="src", globs=["*.py", "docs/*.md"])
+    assert sub.matches({"kind": "created", "path": "src/app/main.py"})
+    assert not sub.matches({"kind": "created", "path": "src/app/main.ts"})
+    assert not sub.matches({"kind": "created", "path": "srcx/main.py"})
+    assert sub.matches({"kind": "moved", "path": "tmp/x.py", "src": "src/x.py"})
+
+    assert Subscription("s").matches({"kind": "deleted", "path": "anything"})
+    assert Subscription("s", globs=["docs/*.md"]).matches({"kind": "created", "path": "docs/a.md"})
+
+
+def test_api_events_suppress_watcher_echo(tmp_path):
+    async def scenario():
+        hub = FsEventHub(str(tmp_path), watcher="none", debounce=0.01)
+        batches = []
+        hub.add_listener(lambda token, events: batches.append(events))
+        (tmp_path / "a.txt").write_text("api")
+        hub.publish("created", "a.txt")
+        await asyncio.sleep(0.05)
+        # What the watcher would report for the same write
+        hub._add({"kind": "created", "path": "a.txt"})
+        hub._add({"kind": "modified", "path": "a.txt"})
+        hub._add({"kind": "created", "path": "b.txt"})
+        await asyncio.sleep(0.05)
+        # Someone else edits the file right after: not an echo
+        (tmp_path / "a.txt").write_text("external edit")
+        hub._add({"kind": "modified", "path": "a.txt"})
+        await asyncio.sleep(0.05)
+        await hub.stop()
+        return batches
+
+    batches = asyncio.run(scenario())
+    assert batches == [
+        [{"kind": "created", "path": "a.txt", "dir": False}],
+        [{"kind": "created", "path": "b.txt"}],
+        [{"kind": "modified", "path": "a.txt", "dir": False}],
+    ]
+
+
+@pytest.mark.parametrize("watcher", ["poll", "kernel"])
+def test_watcher_reports_external_changes(tmp_path, watcher):
+    if watcher == "kernel":
+        pytest.importorskip("watchfiles")
+    (tmp_path / "node_modules").mkdir()
+
+    async def scenario():
+        hub = FsEventHub(str(tmp_path), watcher=watcher, debounce=0.05, poll_interval=0.05)
+        seen = asyncio.Queue()
+        hub.add_listener(lambda token, events: [seen.put_nowait(ev) for ev in events])
+        await asyncio.sleep(0.3)
+        (tmp_path / "node_modules" / "ignored.js").write_text("x")
+        (tmp_path / "new.txt").write_text("hi")
+        try:
+            ev = await asyncio.wait_for(seen.get(), timeout=5)
+        finally:
+            backend = hub.backend
+            await hub.stop()
+        return ev, backend
+
+    ev, backend = asyncio.run(scenario())
+    assert backend == watcher
+    assert ev["path"] == "new.txt"
+    assert ev["kind"] in ("created", "modified")
+
+
+@pytest.fixture()
+def app(main):
+    app = main.create_app(warmup=False)
+    # API mutations only, so the test does not race the watcher
+    app.state.fs_events.watcher = "none"
+    app.state.fs_events.debounce = 0.01
+    return app
+
+
+def test_ws_pushes_api_mutations(app, tmp_path):
+    with TestClient(app) as client, client.websocket_connect("/ws/fs") as ws:
+        ws.send_json({"type": "subscribe", "id": "s1", "glob": "*.txt"})
+        assert ws.receive_json()["type"] == "subscribed"
+
+        client.post("/api/fs/mkdir", json={"path": "d"})
+        client.post("/api/fs/write", json={"path": "d/a.txt", "content": "hi"})
+        msg = ws.receive_json()
+        assert msg["type"] == "events" and msg["id"] == "s1"
+        assert msg["events"] == [{"kind": "created", "path": "d/a.txt", "dir": False}]
+
+        client.post("/api/fs/move", json={"src": "d/a.txt", "dst": "b.txt"})
+        assert ws.receive_json()["events"] == [
+            {"kind": "moved", "path": "b.txt", "src": "d/a.txt", "dir": False}
+        ]
+        client.post("/api/fs/delete", json={"path": "b.txt"})
+        assert ws.receive_json()["events"] == [{"kind": "deleted", "path": "b.txt"}]
+
+
+def test_ws_resync_tokens(app, tmp_path):
+    hub = app.state.fs_events
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws/fs") as ws:
+            ws.send_json({"type": "subscribe", "id": "s"})
+            token = ws.receive_json()["token"]
+
+        # The only client dropped; the hub keeps recording during the grace period
+        client.post("/api/fs/write", json={"path": "a.txt", "content": "hi"})
+
+        with client.websocket_connect("/ws/fs") as ws:
+            ws.send_json({"type": "subscribe", "id": "s", "since": token})
+            assert ws.receive_json()["type"] == "subscribed"
+            replay = ws.receive_json()
+            assert replay["events"][0]["path"] == "a.txt"
+
+        # Once the grace period runs out the epoch resets and tokens go stale
+        client.portal.call(hub.stop)
+        with client.websocket_connect("/ws/fs") as ws:
+            ws.send_json({"type": "subscribe", "id": "s", "since": replay["token"]})
+            ws.receive_json()
+            assert ws.receive_json()["type"] == "resync"
+
+
+def test_hub_stops_after_idle_grace(tmp_path):
+    async def scenario():
+        hub = FsEventHub(str(tmp_path), watcher="none", idle_grace=0.05)
+        listener = lambda token, events: None  # noqa: E731
+        hub.add_listener(listener)
+        await hub.remove_listener(listener)
+        assert hub.running
+        # Rejoining within the grace period keeps the epoch
+        token = hub.token
+        hub.add_listener(listener)
+        await hub.remove_listener(listener)
+        assert hub.token == token
+        await asyncio.sleep(0.1)
+        return hub.running
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_ws_overflow_sends_one_resync(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(fs_events, "QUEUE_SIZE", 2)
+    with TestClient(app) as client, client.websocket_connect("/ws/fs") as ws:
+        ws.send_json([])  # not an object: ignored
+        for sid in "abc":
+            ws.send_json({"type": "subscribe", "id": sid})
+            assert ws.receive_json()["type"] == "subscribed"
+
+        # One batch fans out to three subscriptions and overflows the queue
+        client.post("/api/fs/write", json={"path": "a.txt", "content": "hi"})
+        msg = ws.receive_json()
+        assert msg["type"] == "resync" and "id" not in msg
+
+
+def test_malformed_subscribe_is_rejected(app, tmp_path):
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws/fs") as good, client.websocket_connect("/ws/fs") as bad:
+            bad.send_json({"type": "subscribe", "id": "x", "glob": [1]})
+            assert bad.receive_json() == {"type": "error", "id": "x", "error": "invalid subscribe"}
+            bad.send_json({"type": "subscribe", "id": "y", "path": 5})
+            assert bad.receive_json()["type"] == "error"
+            good.send_json({"type": "subscribe", "id": "s"})
+            assert good.receive_json()["type"] == "subscribed"
+
+            client.post("/api/fs/write", json={"path": "a.txt", "content": "hi"})
+            assert good.receive_json()["events"][0]["path"] == "a.txt"
+
+
+def test_failing_listener_does_not_starve_others(tmp_path):
+    async def scenario():
+        hub = FsEventHub(str(tmp_path), watcher="none", debounce=0.01)
+        asyncio.get_running_loop().set_exception_handler(lambda loop, ctx: None)
+        seen = []
+
+        def broken(token, events):
+            raise TypeError("boom")
+
+        hub.add_listener(broken)
+        hub.add_listener(lambda token, events: seen.extend(events))
+        hub.publish("created", "a.txt")
+        await asyncio.sleep(0.05)
+        await hub.stop()
+        return seen
+
+    assert asyncio.run(scenario()) == [{"kind": "created", "path": "a.txt"}]
+
+
+def test_events_stay_with_the_app_that_made_the_change(main):
+    apps = [main.create_app(warmup=False) for _ in range(2)]
+    for app in apps:
+        app.state.fs_events.watcher = "none"
+        app.state.fs_events.debounce = 0.01
+    with TestClient(apps[0]) as a, TestClient(apps[1]) as b:
+        with a.websocket_connect("/ws/fs") as wa, b.websocket_connect("/ws/fs") as wb:
+            for ws in (wa, wb):
+                ws.send_json({"type": "subscribe", "id": "s"})
+                ws.receive_json()
+            b.post("/api/fs/write", json={"path": "b.txt", "content": "x"})
+            assert wb.receive_json()["events"][0]["path"] == "b.txt"
+            a.post("/api/fs/write", json={"path": "a.txt", "content": "x"})
+            # a's hub saw only its own write
+            assert wa.receive_json()["events"] == [{"kind": "created", "path": "a.txt", "dir": False}]
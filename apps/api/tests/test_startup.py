@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+API_DIR = Path(__file__).resolve().parents[1]
+
+# Measured locally at ~0.25s for ``import main`` (almost all of it FastAPI
+# itself) and ~0.05s for ``create_app()``. The budgets leave headroom for slow
+# CI machines while still catching an eagerly imported subsystem.
+IMPORT_BUDGET_S = 1.0
+FACTORY_BUDGET_S = 0.5
+
+HEAVY_MODULES = [
+    "pty",
+    "routers.fs",
+    "settings",
+    "schemas",
+    "services.terminal",
+    "services.codex_adapter",
+]
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+loaded = [m for m in %r if m in sys.modules]
+main.create_app()
+t2 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "factory": t2 - t1, "loaded": loaded}))
+""" % (HEAVY_MODULES,)
+
+
+def _probe(project_root):
+    env = dict(os.environ, PROJECT_ROOT=str(project_root))
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=API_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout)
+
+
+def test_import_and_factory_within_budget(tmp_path):
+    # Best of three fresh interpreters to smooth over scheduler noise
+    runs = [_probe(tmp_path) for _ in range(3)]
+    assert runs[0]["loaded"] == []
+    assert min(r["import"] for r in runs) < IMPORT_BUDGET_S
+    assert min(r["factory"] for r in runs) < FACTORY_BUDGET_S
+
+
+def test_health_reports_liveness_and_readiness(main):
+    app = main.create_app()
+    with TestClient(app) as client:
+        subsystems = app.state.subsystems
+
+        async def wait_for_warmup():
+            # Warmup runs in the background on the app's loop
+            await subsystems.start_warmup()
+
+        client.portal.call(wait_for_warmup)
+
+        resp = client.get("/health")
+        assert resp.status_code == 200
+        assert resp.json()["ok"] is True
+        assert resp.json()["ready"] is True
+
+        resp = client.get("/health/ready")
+        assert resp.status_code == 200
+        assert set(resp.json()["subsystems"]) == {"codex", "terminal", "coordination"}
+
+
+def test_subsystems_load_on_first_use(main):
+    app = main.create_app(warmup=False)
+    with TestClient(app) as client:
+        resp = client.get("/health/ready")
+        assert resp.status_code == 503
+        assert resp.json()["subsystems"]["terminal"]["state"] == "pending"
+        assert client.get("/health").json()["ok"] is True
+
+        client.portal.call(app.state.subsystems.get, "codex")
+        status = client.get("/health/ready").json()["subsystems"]
+        assert status["codex"]["state"] == "ready"
+        assert status["terminal"]["state"] == "pending"
+
+
+def test_failed_subsystem_is_reported_and_retried():
+    from services.subsystems import Subsystems
+
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return "ok"
+
+    subsystems = Subsystems()
+    subsystems.register("db", flaky)
+
+    async def scenario():
+        await subsystems.start_warmup()
+        assert not subsystems.ready
+        assert subsystems.status()["db"]["error"] == "RuntimeError: boom"
+        assert await subsystems.get("db") == "ok"
+        assert subsystems.ready
+
+    asyncio.run(scenario())
+
+
+def test_health_checks_update_readiness():
+    from services.subsystems import Subsystems
+
+    subsystems = Subsystems()
+    subsystems.register("store", lambda: "ok")
+
+    async def scenario():
+        await subsystems.get("store")
+        subsystems.report("store", ConnectionError("down"))
+        assert not subsystems.ready
+        assert subsystems.status()["store"]["error"] == "ConnectionError: down"
+        subsystems.report("store")
+        assert subsystems.ready
+
+    asyncio.run(scenario())
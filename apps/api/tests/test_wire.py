@@ -0,0 +1,139 @@
+import sys
+from pathlib import Path
+
+import msgpack
+import pytest
+from fastapi.testclient import TestClient
+
+from schemas import Out
+from services import wire
+
+
+def _out(type_, message_id, payload):
+    return Out(type=type_, sessionId="s1", messageId=message_id, payload=payload)
+
+
+def test_compact_interns_message_ids():
+    codec = wire.CompactCodec()
+    first = codec.pack(_out("partial", "msg-a", {"text": "hi"}))
+    second = codec.pack(_out("partial", "msg-a", {"text": "there"}))
+    other = codec.pack(_out("final", "msg-b", {"done": True}))
+
+    assert first == {"t": 1, "M": "msg-a", "m": 0, "p": {"text": "hi"}}
+    assert second == {"t": 1, "m": 0, "p": {"text": "there"}}
+    assert other == {"t": 2, "M": "msg-b", "m": 1, "p": {"done": True}}
+
+    # Unknown event types are sent verbatim
+    assert codec.pack(_out("custom", "msg-a", {}))["t"] == "custom"
+
+
+@pytest.mark.parametrize("codec_cls", [wire.CompactCodec, wire.MsgpackCodec])
+def test_compact_codecs_round_trip_to_canonical(codec_cls):
+    server, client = codec_cls(), codec_cls(assign=False)
+    for out in [
+        _out("partial", "msg-a", {"text": "hé"}),
+        _out("partial", "msg-a", {"text": "llo"}),
+        _out("tool_request", "msg-b", {"name": "ls"}),
+    ]:
+        ev = client.decode(server.encode(out))
+        assert Out(sessionId="s1", **ev) == out
+
+
+def test_decode_client_frames():
+    codec = wire.CompactCodec()
+    codec.encode(_out("partial", "msg-a", {"text": "x"}))
+
+    assert codec.decode('{"t":0,"M":"c1","p":{"text":"hi"}}') == {
+        "type": "event",
+        "messageId": "c1",
+        "payload": {"text": "hi"},
+    }
+    # Refer back to an id the server announced
+    assert codec.decode('{"t":0,"m":0,"p":{}}')["messageId"] == "msg-a"
+    assert "messageId" not in codec.decode('{"t":0,"m":7,"p":{}}')
+
+    # Clients cannot number ids, so they cannot shadow the server's
+    assert codec.decode('{"t":0,"M":"c1","m":0,"p":{}}')["messageId"] == "c1"
+    assert codec.decode('{"t":0,"m":0,"p":{}}')["messageId"] == "msg-a"
+
+
+def test_decode_ignores_frames_that_are_not_objects():
+    for codec in (wire.JsonCodec(), wire.CompactCodec()):
+        assert codec.decode("[]") is None
+        assert codec.decode("1") is None
+    assert wire.MsgpackCodec().decode(msgpack.packb([1])) is None
+
+    assert wire.CompactCodec().decode('{"t":0,"M":"c1","p":[1]}')["payload"] == {}
+    assert wire.CompactCodec().decode('{"t":0,"m":[],"p":{}}') == {"type": "event", "payload": {}}
+    assert wire.JsonCodec().decode('{"messageId":5,"payload":"x"}') == {"payload": {}}
+
+
+def test_client_codec_learns_server_numbers():
+    server, client = wire.CompactCodec(), wire.CompactCodec(assign=False)
+    client.decode(server.encode(_out("partial", "msg-a", {})))
+    # A client refers to the announced number, and announces new ids in full
+    assert client.pack(_out("event", "msg-a", {})) == {"t": 0, "m": 0, "p": {}}
+    assert client.pack(_out("event", "c1", {})) == {"t": 0, "M": "c1", "p": {}}
+
+
+def test_negotiate():
+    assert isinstance(wire.negotiate([wire.MSGPACK, wire.JSON]), wire.MsgpackCodec)
+    assert isinstance(wire.negotiate(["other", wire.COMPACT]), wire.CompactCodec)
+    assert wire.negotiate([wire.JSON]).subprotocol == wire.JSON
+    fallback = wire.negotiate(["other"])
+    assert isinstance(fallback, wire.JsonCodec)
+    assert fallback.subprotocol is None
+
+
+def test_compact_encodings_shrink_the_wire():
+    sys.path.append(str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    import bench_wire
+
+    results = bench_wire.run(chunks=200)
+    assert results["compact"]["wireBytes"] < 0.4 * results["json"]["wireBytes"]
+    assert results["msgpack"]["wireBytes"] < results["compact"]["wireBytes"]
+
+
+@pytest.fixture()
+def client(main, monkeypatch):
+    from services import codex_adapter
+
+    async def fake_codex(prompt):
+        for chunk in ["a", "b"]:
+            yield chunk
+
+    monkeypatch.setattr(codex_adapter, "invoke_codex", fake_codex)
+    with TestClient(main.create_app(warmup=False)) as c:
+        yield c
+
+
+def test_session_ws_default_json(client):
+    with client.websocket_connect("/ws/session/s1") as ws:
+        assert ws.accepted_subprotocol is None
+        ws.send_json({"type": "event", "messageId": "m1", "payload": {"text": "hi"}})
+        first = ws.receive_json()
+        assert first == {"type": "partial", "sessionId": "s1", "messageId": "m1", "payload": {"text": "a"}}
+        ws.receive_json()
+        assert ws.receive_json()["type"] == "final"
+
+
+def test_session_ws_msgpack(client):
+    with client.websocket_connect("/ws/session/s1", subprotocols=[wire.MSGPACK]) as ws:
+        assert ws.accepted_subprotocol == wire.MSGPACK
+        ws.send_bytes(msgpack.packb({"t": 0, "M": "m1", "p": {"text": "hi"}}))
+        frames = [msgpack.unpackb(ws.receive_bytes()) for _ in range(3)]
+    assert frames == [
+        {"t": 1, "M": "m1", "m": 0, "p": {"text": "a"}},
+        {"t": 1, "m": 0, "p": {"text": "b"}},
+        {"t": 2, "m": 0, "p": {"done": True}},
+    ]
+
+
+def test_session_ws_skips_malformed_frames(client):
+    with client.websocket_connect("/ws/session/s1", subprotocols=[wire.MSGPACK]) as ws:
+        ws.send_bytes(msgpack.packb([]))
+        ws.send_bytes(b"\xc1")  # never valid MessagePack
+        ws.send_bytes(msgpack.packb({"t": 0, "M": "m1", "p": "not a map"}))
+        first = msgpack.unpackb(ws.receive_bytes())
+    # The socket survived and answered the last frame, with an empty prompt
+    assert first["M"] == "m1" and first["t"] == 1
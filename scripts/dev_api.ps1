@@ -15,4 +15,4 @@ if (-not $Env:PROJECT_ROOT) {
   $Env:PROJECT_ROOT = $ROOT
 }
 
-python -m uvicorn main:app --reload --port $PORT
+python -m uvicorn --factory main:create_app --reload --port $PORT
@@ -15,4 +15,4 @@ fi
 # Ensure PROJECT_ROOT is set so settings can validate
 export PROJECT_ROOT="${PROJECT_ROOT:-$ROOT}"
 
-python -m uvicorn main:app --reload --port "$PORT"
+python -m uvicorn --factory main:create_app --reload --port "$PORT"